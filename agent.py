@@ -5,18 +5,47 @@ Hermit Crab Agent - 寄居蟹自动迁移系统主程序
 
 import os
 import sys
+import base64
+import signal
+import logging
 import argparse
+import threading
+import subprocess
+import traceback
 import time
-from datetime import datetime
+import contextlib
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from functools import cached_property
 
 # 添加模块路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from modules import (
-    Logger, get_config, get_current_ip,
-    Monitor, Scanner, Migrator, Initializer,
-    GitHubSync, CloudFlareAPI, ResendNotifier, get_ssh_password
-)
+from modules import Logger, get_config, get_current_ip, get_ssh_password
+from modules.utils import format_datetime, json_loads
+
+_BANNER = "=" * 60
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+DAEMON_SERVICE = "hermit-crab-daemon.service"
+
+# cgroup v2 下 systemd 服务的进程列表，非空即表示服务在运行
+DAEMON_CGROUP_PROCS = f"/sys/fs/cgroup/system.slice/{DAEMON_SERVICE}/cgroup.procs"
+
+
+class _MigrationLogFilter(logging.Filter):
+    """仅放行迁移过程中的日志，并为日志记录附加迁移ID"""
+
+    def __init__(self):
+        super().__init__()
+        self.migration_id = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.migration_id is None:
+            return False
+        record.migration_id = self.migration_id
+        return True
 
 
 class HermitCrabAgent:
@@ -30,36 +59,141 @@ class HermitCrabAgent:
         """
         # 加载配置
         self.config = get_config()
+        self._derive_config_fields()
+        
+        # 日志路径（日志处理器启动时绑定，配置重新加载后不变）
+        log_dir = os.path.join(self.config['base']['install_path'], 'logs')
+        self.log_file = os.path.join(log_dir, 'hermit_crab.log')
+        self.migration_log_file = os.path.join(log_dir, 'migrations', 'migration.log')
         
         # 设置日志
-        log_file = os.path.join(
-            self.config['base']['install_path'],
-            'logs',
-            'hermit_crab.log'
-        )
         logger_instance = Logger()
         logger_instance.setup(
             log_level=self.config['base']['log_level'],
-            log_file=log_file
+            log_file=self.log_file,
+            log_buffer=self.config['base']['log_buffer']
         )
         self.logger = logger_instance.get_logger()
         
-        # 初始化模块
-        self.monitor = Monitor(self.config)
-        self.scanner = Scanner(self.config)
-        self.migrator = Migrator(self.config)
-        self.initializer = Initializer(self.config)
-        self.github = GitHubSync(self.config)
-        self.cloudflare = CloudFlareAPI(self.config)
-        self.notifier = ResendNotifier(self.config)
+        # 迁移日志（启动时挂载一次，按大小轮转，仅在迁移过程中写入）
+        os.makedirs(os.path.dirname(self.migration_log_file), exist_ok=True)
+        self._migration_filter = _MigrationLogFilter()
+        migration_handler = logging.handlers.RotatingFileHandler(
+            self.migration_log_file,
+            maxBytes=10_000_000,
+            backupCount=20,
+            encoding='utf-8',
+            delay=True
+        )
+        migration_handler.setLevel(logging.DEBUG)
+        migration_handler.setFormatter(logging.Formatter(
+            '[%(asctime)s] [%(levelname)s] [%(migration_id)s] %(message)s',
+            datefmt=_TS_FMT
+        ))
+        migration_handler.addFilter(self._migration_filter)
+        self.logger.addHandler(migration_handler)
+
+        # 守护进程停止信号（SIGTERM/SIGHUP 触发）
+        self._stop_event = threading.Event()
+
+        # 守护进程运行状态缓存 (is_active, monotonic时间戳)
+        self._daemon_status_cache = None
+
+        # 最近一次发送生命周期警告的日期（每天最多发送一次）
+        self._last_warning_date = None
 
         self.logger.info("Hermit Crab Agent 已启动")
 
-        # 显示通知状态
-        if self.notifier.is_available():
-            self.logger.info(f"✅ 邮件通知已启用 -> {', '.join(self.config['notification']['to_emails'])}")
+        # 显示通知状态（按配置判断，不必为此加载通知模块）
+        notification = self.config['notification']
+        if notification['enabled'] and notification['resend_api_key'] and notification['to_emails']:
+            self.logger.info(f"✅ 邮件通知已启用 -> {', '.join(notification['to_emails'])}")
         else:
             self.logger.debug("邮件通知未启用")
+
+    def _derive_config_fields(self):
+        """预先计算由配置派生的常用字段（域名、数据目录、标记文件）"""
+        self.current_domain = self.config['base']['current_domain']
+        self.current_subdomain = self.current_domain.split('.', 1)[0]
+        self.data_dir = os.path.join(self.config['base']['install_path'], 'data')
+        self.flag_file = os.path.join(self.data_dir, 'migration_flag.json')
+
+    def _reload_config(self, config: dict):
+        """
+        应用新配置：已创建的功能模块丢弃，下次使用时按新配置重建
+
+        Args:
+            config: 新的配置字典
+        """
+        self.config = config
+        self._derive_config_fields()
+        # 旧通知器停止重试线程、发完已提交的邮件后再丢弃
+        self._flush_notifications()
+        for name in ('monitor', 'scanner', 'migrator', 'initializer', 'github', 'cloudflare', 'notifier'):
+            self.__dict__.pop(name, None)
+        self.logger.info("配置文件已变化，已重新加载配置")
+
+    def _flush_notifications(self):
+        """
+        等待已提交的邮件发送完成（send_email 默认异步，返回 True 仅表示已提交）
+
+        通知器尚未创建时直接返回，不为此加载通知模块
+        """
+        if 'notifier' in self.__dict__:
+            self.notifier.close()
+
+    @cached_property
+    def current_ip(self) -> str:
+        """当前服务器公网IP（首次访问时探测，之后复用）"""
+        return get_current_ip()
+
+    def refresh_ip(self):
+        """
+        绕过IP缓存立即重新探测（同时刷新 get_current_ip 的模块级缓存，其他模块随之获得新IP）
+        """
+        self.__dict__['current_ip'] = get_current_ip(force=True)
+
+    @cached_property
+    def monitor(self):
+        """生命周期监控器"""
+        from modules import Monitor
+        return Monitor(self.config)
+
+    @cached_property
+    def scanner(self):
+        """服务器列表扫描器"""
+        from modules import Scanner
+        return Scanner(self.config)
+
+    @cached_property
+    def migrator(self):
+        """迁移执行器"""
+        from modules import Migrator
+        return Migrator(self.config)
+
+    @cached_property
+    def initializer(self):
+        """新服务器初始化器"""
+        from modules import Initializer
+        return Initializer(self.config)
+
+    @cached_property
+    def github(self):
+        """GitHub同步器"""
+        from modules import GitHubSync
+        return GitHubSync(self.config)
+
+    @cached_property
+    def cloudflare(self):
+        """CloudFlare DNS管理器"""
+        from modules import CloudFlareAPI
+        return CloudFlareAPI(self.config)
+
+    @cached_property
+    def notifier(self):
+        """邮件通知器"""
+        from modules import ResendNotifier
+        return ResendNotifier(self.config)
     
     def cmd_init(self):
         """
@@ -69,15 +203,15 @@ class HermitCrabAgent:
         - 记录当前时间戳作为添加日期
         - 从 config.yaml 读取 current_domain
         """
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("初始化 Hermit Crab")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
 
         # 初始化生命周期（系统自动记录当前时间）
         lifecycle = self.monitor.initialize_lifecycle()
 
         # 显示当前域名（从配置读取）
-        current_domain = self.config['base']['current_domain']
+        current_domain = self.current_domain
         self.logger.info(f"业务域名: {current_domain}")
 
         self.logger.info("✅ 初始化完成")
@@ -92,28 +226,26 @@ class HermitCrabAgent:
             old_lifecycle_json: 源服务器的lifecycle.json内容（JSON字符串）
             old_lifecycle_base64: 源服务器的lifecycle.json内容（base64编码）
         """
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("更新生命周期（保留迁移历史）")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
 
         # 获取当前IP
-        current_ip = get_current_ip()
+        current_ip = self.current_ip
         self.logger.info(f"当前服务器IP: {current_ip}")
 
-        # 从GitHub或本地获取服务器信息
-        if self.github.is_available():
+        # 从GitHub或本地获取服务器信息（拉取成功则直接使用内存中的数据）
+        nodes_data = None
+        if self.github.available:
             self.logger.info("从GitHub同步服务器列表...")
             nodes_data = self.github.pull_nodes()
             if nodes_data:
                 self.scanner.save_nodes(nodes_data)
+        if not nodes_data:
+            nodes_data = self.scanner.load_nodes()
 
         # 查找当前服务器信息
-        nodes_data = self.scanner.load_nodes()
-        target_server = None
-        for server in nodes_data.get('servers', []):
-            if server.get('ip') == current_ip:
-                target_server = server
-                break
+        target_server = self.scanner.index_by_ip(nodes_data).get(current_ip)
 
         if not target_server:
             self.logger.error(f"❌ 未找到当前服务器信息: {current_ip}")
@@ -124,18 +256,14 @@ class HermitCrabAgent:
 
         # 优先使用base64编码的参数
         if old_lifecycle_base64:
-            import base64
-            import json
             try:
-                decoded_json = base64.b64decode(old_lifecycle_base64).decode('utf-8')
-                old_lifecycle = json.loads(decoded_json)
+                old_lifecycle = json_loads(base64.b64decode(old_lifecycle_base64))
                 self.logger.info(f"成功解码base64 lifecycle数据")
             except Exception as e:
                 self.logger.warning(f"解码base64 lifecycle失败: {e}")
         elif old_lifecycle_json:
-            import json
             try:
-                old_lifecycle = json.loads(old_lifecycle_json)
+                old_lifecycle = json_loads(old_lifecycle_json)
             except Exception as e:
                 self.logger.warning(f"解析旧lifecycle失败: {e}")
 
@@ -146,22 +274,48 @@ class HermitCrabAgent:
         self.monitor.display_status()
         return True
     
+    def _daemon_active(self) -> bool:
+        """
+        检查守护进程服务是否在运行
+
+        优先读取 cgroup v2 进程列表，避免 fork systemctl；结果缓存1秒
+
+        Returns:
+            是否在运行
+        """
+        if self._daemon_status_cache is not None:
+            is_active, checked_at = self._daemon_status_cache
+            if time.monotonic() - checked_at < 1:
+                return is_active
+
+        if os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+            try:
+                with open(DAEMON_CGROUP_PROCS, 'r') as f:
+                    is_active = bool(f.read().strip())
+            except FileNotFoundError:
+                # 服务未运行时 systemd 会删除其 cgroup
+                is_active = False
+        else:
+            result = subprocess.run(
+                ["systemctl", "is-active", DAEMON_SERVICE],
+                capture_output=True, text=True, check=False
+            )
+            is_active = result.stdout.strip() == "active"
+
+        self._daemon_status_cache = (is_active, time.monotonic())
+        return is_active
+
     def cmd_status(self):
         """显示当前状态"""
         self.monitor.display_status()
 
         # 显示自动迁移状态
-        import subprocess
         try:
-            result = subprocess.run(
-                ["systemctl", "is-active", "hermit-crab-daemon.service"],
-                capture_output=True, text=True, check=False
-            )
-            is_active = result.stdout.strip() == "active"
+            is_active = self._daemon_active()
 
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
             self.logger.info("自动迁移状态")
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
             if is_active:
                 self.logger.info("状态: ✅ 已启动")
                 self.logger.info("说明: 系统将自动监控并在需要时执行迁移")
@@ -169,12 +323,12 @@ class HermitCrabAgent:
                 self.logger.info("状态: ❌ 未启动")
                 self.logger.info("说明: 需要手动执行迁移")
                 self.logger.info("提示: 使用 'hermit-crab start' 启动自动迁移")
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
         except Exception as e:
             self.logger.debug(f"无法检查daemon状态: {e}")
 
         # 如果启用了GitHub，显示服务器列表
-        if self.github.is_available():
+        if self.github.available:
             self.logger.info("\n正在从GitHub同步服务器列表...")
             nodes_data = self.github.pull_nodes()
             if nodes_data:
@@ -188,9 +342,9 @@ class HermitCrabAgent:
         """
         检查是否需要迁移
         """
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("执行迁移检查")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
 
         # 检查生命周期
         status = self.monitor.get_status()
@@ -199,7 +353,7 @@ class HermitCrabAgent:
             self.logger.error("❌ 生命周期未初始化，请先运行: agent.py init")
             return False
 
-        self.logger.info(f"当前服务器剩余: {status['remaining_days']} 天")
+        self.logger.info("当前服务器剩余: %s 天", status['remaining_days'])
 
         if not status['should_migrate']:
             self.logger.info("✅ 暂不需要迁移")
@@ -207,23 +361,44 @@ class HermitCrabAgent:
 
         self.logger.warning("🚨 需要执行迁移！")
 
+        # 生命周期警告每天只发送一次，避免守护进程每轮检查重复发送
+        today = datetime.now().date()
+        if self._last_warning_date == today:
+            self.logger.debug("今日已发送生命周期警告，跳过")
+            return True
+
         # 检查可用服务器数量
-        available_servers = self.scanner.get_available_servers()
+        available_servers = self.scanner.get_available_servers(current_ip=self.current_ip)
         available_count = len(available_servers)
-        self.logger.info(f"当前可用备用服务器数量: {available_count} 台")
+        self.logger.info("当前可用备用服务器数量: %d 台", available_count)
 
         # 发送生命周期警告通知（包含可用服务器数量）
-        current_ip = get_current_ip()
+        current_ip = self.current_ip
+        self._last_warning_date = today
         self.notifier.notify_lifecycle_warning(
             server_ip=current_ip,
             remaining_days=status['remaining_days'],
             total_days=self.config['lifecycle']['total_days'],
-            domain=self.config['base']['current_domain'],
+            domain=self.current_domain,
             available_servers_count=available_count
         )
 
         return True
     
+    @contextlib.contextmanager
+    def _migration_context(self, migration_id: str):
+        """
+        迁移日志上下文：期间的日志同时写入迁移日志文件，并带上迁移ID
+
+        Args:
+            migration_id: 迁移ID（迁移开始时间）
+        """
+        self._migration_filter.migration_id = migration_id
+        try:
+            yield
+        finally:
+            self._migration_filter.migration_id = None
+
     def cmd_migrate(self, target_ip: str = None, password: str = None, auto: bool = False, force: bool = False):
         """
         执行迁移
@@ -234,38 +409,36 @@ class HermitCrabAgent:
             auto: 是否自动模式（自动选择目标）
             force: 强制迁移（忽略生命周期检查，选择剩余时间最长的服务器）
         """
-        # 创建独立的迁移日志
-        from datetime import datetime
-        import logging
-
+        # 迁移日志按迁移ID区分
         migration_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        migration_log_dir = os.path.join(
-            self.config['base']['install_path'],
-            'logs',
-            'migrations'
-        )
-        os.makedirs(migration_log_dir, exist_ok=True)
+        with self._migration_context(migration_time):
+            try:
+                return self._run_migration(migration_time, target_ip, password, auto, force)
+            finally:
+                # 迁移结果邮件发出后再返回（守护进程随后可能退役并退出）
+                self._flush_notifications()
 
-        migration_log_file = os.path.join(
-            migration_log_dir,
-            f'migration_{migration_time}.log'
-        )
+    def _run_migration(self, migration_time: str, target_ip: str, password: str, auto: bool, force: bool):
+        """
+        执行迁移流程（由 cmd_migrate 在迁移日志上下文中调用）
 
-        # 添加文件日志处理器
-        file_handler = logging.FileHandler(migration_log_file, encoding='utf-8')
-        file_handler.setLevel(logging.DEBUG)
-        file_formatter = logging.Formatter(
-            '[%(asctime)s] [%(levelname)s] %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        file_handler.setFormatter(file_formatter)
-        self.logger.addHandler(file_handler)
+        Args:
+            migration_time: 迁移ID
+            target_ip: 目标服务器IP（可选，自动选择）
+            password: SSH密码（可选，从环境变量读取）
+            auto: 是否自动模式（自动选择目标）
+            force: 强制迁移
+        """
+        migration_log_file = self.migration_log_file
+
+        # GitHub 是否可用只在迁移开始时确定一次，整个流程（加锁、最终更新、释放锁）使用同一模式
+        use_github = self.github.available
 
         try:
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
             self.logger.info("开始执行迁移流程")
-            self.logger.info(f"迁移日志: {migration_log_file}")
-            self.logger.info("=" * 60)
+            self.logger.info("迁移日志: %s (迁移ID: %s)", migration_log_file, migration_time)
+            self.logger.info(_BANNER)
 
             # 1. 检查是否需要迁移
             status = self.monitor.get_status()
@@ -275,18 +448,19 @@ class HermitCrabAgent:
                 return False
 
             current_remaining = status['remaining_days']
-            current_ip = get_current_ip()
-            self.logger.info(f"当前服务器IP: {current_ip}")
-            self.logger.info(f"当前服务器剩余: {current_remaining} 天")
+            current_ip = self.current_ip
+            self.logger.info("当前服务器IP: %s", current_ip)
+            self.logger.info("当前服务器剩余: %s 天", current_remaining)
 
             # 如果是强制迁移，跳过生命周期检查
             if force:
                 self.logger.warning("⚠️  强制迁移模式：忽略生命周期检查")
 
-            # 2. 同步服务器列表
-            if self.github.is_available():
+            # 2. 同步服务器列表（拉取结果供后续选择目标服务器复用）
+            nodes_data = None
+            if use_github:
                 self.logger.info("从GitHub同步服务器列表...")
-                nodes_data = self.github.pull_nodes()
+                nodes_data = self.github.pull_nodes(force=True)
                 if nodes_data:
                     self.scanner.save_nodes(nodes_data)
 
@@ -300,9 +474,9 @@ class HermitCrabAgent:
 
                 # 如果是强制模式，选择剩余时间最长的服务器
                 if force:
-                    target_server = self.scanner.select_longest_remaining_server()
+                    target_server = self.scanner.select_longest_remaining_server(current_ip, nodes_data)
                 else:
-                    target_server = self.scanner.select_target_server(current_remaining)
+                    target_server = self.scanner.select_target_server(current_remaining, current_ip, nodes_data)
 
                 if target_server is None:
                     self.logger.error("❌ 没有合适的目标服务器")
@@ -318,20 +492,15 @@ class HermitCrabAgent:
                 target_ip = target_server['ip']
             else:
                 # 手动指定IP，查找对应服务器信息
-                available = self.scanner.get_available_servers()
-                target_server = None
-
-                for server in available:
-                    if server['ip'] == target_ip:
-                        target_server = server
-                        break
+                available = self.scanner.get_available_servers(current_ip=current_ip, nodes_data=nodes_data)
+                target_server = self.scanner.index_by_ip({'servers': available}).get(target_ip)
 
                 if target_server is None:
-                    self.logger.error(f"❌ 目标服务器不在可用列表中: {target_ip}")
+                    self.logger.error("❌ 目标服务器不在可用列表中: %s", target_ip)
                     return False
 
-            self.logger.info(f"目标服务器IP: {target_ip}")
-            self.logger.info(f"目标剩余时间: {target_server['remaining_days']} 天")
+            self.logger.info("目标服务器IP: %s", target_ip)
+            self.logger.info("目标剩余时间: %s 天", target_server['remaining_days'])
 
             # 4. 获取SSH密码
             if password is None:
@@ -352,8 +521,8 @@ class HermitCrabAgent:
                 self.logger.info("✅ 使用命令行提供的SSH密码")
 
             # 5. 获取锁（防止并发）
-            if self.github.is_available():
-                self.logger.info(f"尝试获取服务器锁: {target_ip}")
+            if use_github:
+                self.logger.info("尝试获取服务器锁: %s", target_ip)
 
                 if not self.github.acquire_lock(target_ip, current_ip):
                     self.logger.error("❌ 无法获取服务器锁，可能已被其他服务器选中")
@@ -364,7 +533,8 @@ class HermitCrabAgent:
 
             # 6. 执行迁移
             migrate_start_time = datetime.now()
-            self.logger.info(f"迁移开始时间: {migrate_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+            start_ts_str = migrate_start_time.strftime(_TS_FMT)
+            self.logger.info("迁移开始时间: %s", start_ts_str)
 
             # 发送迁移开始通知
             self.notifier.notify_migration_started(
@@ -385,73 +555,60 @@ class HermitCrabAgent:
                 )
 
                 # 释放锁
-                if self.github.is_available():
+                if use_github:
                     self.github.release_lock(target_ip, 'idle')
                 return False
 
             # 7. 记录迁移历史（在初始化目标服务器之前，这样可以传递迁移历史）
             self.monitor.add_migration_record(target_server)
 
-            # 8. 初始化目标服务器
+            # 8. 初始化目标服务器，同时在后台更新DNS（两者互不依赖）
+            dns_future = None
+            if self.cloudflare.available:
+                dns_executor = ThreadPoolExecutor(max_workers=1)
+                dns_future = dns_executor.submit(self._update_dns_for_migration, target_ip, current_ip)
+                dns_executor.shutdown(wait=False)
+
             init_success = self.initializer.initialize_target_server(target_ip, target_server, self.migrator)
             if not init_success:
                 self.logger.error("❌ 目标服务器初始化失败")
                 # 但 Rsync 已经成功，标记为部分成功
                 self.logger.warning("⚠️  迁移主体完成但初始化失败，需要手动完成初始化")
 
-            # 9. 更新DNS（如果启用）
-            if self.cloudflare.is_available():
-                current_subdomain = self.config['base']['current_domain'].split('.')[0]
-
-                # 更新主域名到新服务器
-                self.logger.info(f"更新主域名DNS: {current_subdomain} -> {target_ip}")
-                if self.cloudflare.update_domain_for_migration(current_subdomain, target_ip):
-                    self.logger.info("✅ 主域名DNS已更新")
-                else:
-                    self.logger.warning("⚠️  主域名DNS更新失败，可能需要手动更新")
+            # 9. 更新服务器状态、最终同步互不依赖，并发执行（同时等待DNS更新完成）
+            self.logger.info(_BANNER)
+            self.logger.info("更新DNS/服务器状态，并同步最新日志和数据到新服务器...")
+            self.logger.info(_BANNER)
 
-                # 将旧服务器IP解析到备用域名 b.ssfxx.com
-                self.logger.info(f"更新旧服务器到备用域名: b -> {current_ip}")
-                if self.cloudflare.update_dns_record('b', current_ip):
-                    self.logger.info("✅ 旧服务器已解析到 b.ssfxx.com")
-                else:
-                    self.logger.warning("⚠️  备用域名更新失败")
-
-            # 9. 更新服务器状态（即使初始化失败也要更新）
-            self.logger.info("更新服务器状态...")
-
-            if self.github.is_available():
-                # 目标服务器设置为 active
-                self.github.update_server_status(target_ip, 'active')
-
-                # 删除源服务器（已废弃）
-                self.logger.info(f"删除源服务器: {current_ip}")
-                nodes_data = self.github.pull_nodes()
-                if nodes_data:
-                    servers = nodes_data.get('servers', [])
-                    servers = [s for s in servers if s.get('ip') != current_ip]
-                    nodes_data['servers'] = servers
-                    self.github.push_nodes(nodes_data, f"Remove retired server {current_ip}")
-            else:
-                # 目标服务器设置为 active
-                self.scanner.update_server_status(target_ip, 'active')
-
-                # 删除源服务器
-                nodes_data = self.scanner.load_nodes()
-                servers = nodes_data.get('servers', [])
-                servers = [s for s in servers if s.get('ip') != current_ip]
-                nodes_data['servers'] = servers
-                self.scanner.save_nodes(nodes_data)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = {}
 
-            # 10. 再次增量同步最新的日志和数据到新服务器（保留完整迁移历史）
-            self.logger.info("=" * 60)
-            self.logger.info("同步最新日志和数据到新服务器...")
-            self.logger.info("=" * 60)
+                if dns_future is not None:
+                    futures[dns_future] = "DNS更新"
 
-            if self.migrator.sync_final_updates(target_ip, password):
-                self.logger.info("✅ 最新日志和数据已同步到新服务器")
-            else:
-                self.logger.warning("⚠️  最终同步失败，部分日志可能未同步")
+                # 更新服务器状态（即使初始化失败也要更新）
+                if use_github:
+                    futures[executor.submit(self._finalize_server_status, target_ip, current_ip, use_github)] = "服务器状态更新"
+                else:
+                    # 本地模式下最终同步需要带上更新后的 nodes.json，必须先完成
+                    self._finalize_server_status(target_ip, current_ip, use_github)
+
+                # 10. 再次增量同步最新的日志和数据到新服务器（保留完整迁移历史）
+                futures[executor.submit(self.migrator.sync_final_updates, target_ip, password)] = "最终同步"
+
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        self.logger.error("❌ %s异常: %s", name, e)
+                        continue
+
+                    if name == "最终同步":
+                        if ok:
+                            self.logger.info("✅ 最新日志和数据已同步到新服务器")
+                        else:
+                            self.logger.warning("⚠️  最终同步失败，部分日志可能未同步")
 
             # 计算总耗时
             migrate_end_time = datetime.now()
@@ -462,25 +619,24 @@ class HermitCrabAgent:
                 source_ip=current_ip,
                 target_ip=target_ip,
                 duration_seconds=total_elapsed,
-                domain=self.config['base']['current_domain']
+                domain=self.current_domain
             )
 
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
             self.logger.info("🎉 迁移流程全部完成！")
-            self.logger.info("=" * 60)
-            self.logger.info(f"源服务器IP: {current_ip}")
-            self.logger.info(f"目标服务器IP: {target_ip}")
-            self.logger.info(f"迁移开始时间: {migrate_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-            self.logger.info(f"迁移结束时间: {migrate_end_time.strftime('%Y-%m-%d %H:%M:%S')}")
-            self.logger.info(f"总耗时: {total_elapsed:.2f}秒 ({total_elapsed/60:.1f}分钟)")
-            self.logger.info(f"迁移日志已保存: {migration_log_file}")
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
+            self.logger.info("源服务器IP: %s", current_ip)
+            self.logger.info("目标服务器IP: %s", target_ip)
+            self.logger.info("迁移开始时间: %s", start_ts_str)
+            self.logger.info("迁移结束时间: %s", migrate_end_time.strftime(_TS_FMT))
+            self.logger.info("总耗时: %.2f秒 (%.1f分钟)", total_elapsed, total_elapsed / 60)
+            self.logger.info("迁移日志已保存: %s", migration_log_file)
+            self.logger.info(_BANNER)
 
             return True
 
         except Exception as e:
-            self.logger.error(f"迁移异常: {e}")
-            import traceback
+            self.logger.error("迁移异常: %s", e)
             self.logger.error(traceback.format_exc())
 
             # 发送迁移失败通知
@@ -492,14 +648,77 @@ class HermitCrabAgent:
             )
 
             # 释放锁
-            if self.github.is_available():
+            if use_github:
                 self.github.release_lock(target_ip, 'idle')
             return False
         finally:
-            # 移除文件日志处理器
-            self.logger.removeHandler(file_handler)
-            file_handler.close()
+            # 关闭到目标服务器的复用SSH连接
+            self.migrator.close_connections()
     
+    def _update_dns_for_migration(self, target_ip: str, current_ip: str) -> bool:
+        """
+        迁移后更新DNS：主域名指向新服务器，备用域名指向旧服务器
+
+        Args:
+            target_ip: 新服务器IP
+            current_ip: 旧服务器IP
+
+        Returns:
+            是否全部成功
+        """
+        current_subdomain = self.current_subdomain
+
+        # 主域名指向新服务器，旧服务器IP解析到备用域名 b.ssfxx.com（一次批量请求）
+        self.logger.info("更新DNS: %s -> %s, b -> %s", current_subdomain, target_ip, current_ip)
+        success = self.cloudflare.batch_update([
+            (current_subdomain, target_ip),
+            ('b', current_ip),
+        ])
+        if success:
+            self.logger.info("✅ 主域名DNS已更新，旧服务器已解析到 b.ssfxx.com")
+        else:
+            self.logger.warning("⚠️  DNS更新失败，可能需要手动更新")
+
+        return success
+
+    def _finalize_server_status(self, target_ip: str, current_ip: str, use_github: bool) -> bool:
+        """
+        迁移后更新服务器列表：目标服务器设为 active，删除源服务器
+
+        Args:
+            target_ip: 新服务器IP
+            current_ip: 旧服务器IP（已废弃）
+            use_github: 是否更新GitHub上的服务器列表（与迁移开始时确定的模式一致）
+
+        Returns:
+            是否成功
+        """
+        self.logger.info("更新服务器状态...")
+
+        if use_github:
+            # 目标服务器设置为 active，同时删除源服务器（已废弃），一次提交完成
+            def finalize_nodes(nodes_data):
+                servers_by_ip = self.scanner.index_by_ip(nodes_data)
+                target_server = servers_by_ip.get(target_ip)
+                if target_server:
+                    target_server['status'] = 'active'
+                    target_server['last_heartbeat'] = format_datetime()
+                self.scanner.remove_server_inplace(current_ip, nodes_data, servers_by_ip)
+
+            self.logger.info("目标服务器设为active，删除源服务器: %s", current_ip)
+            return self.github.mutate_nodes(
+                finalize_nodes,
+                f"Activate server {target_ip}, remove retired server {current_ip}"
+            )
+
+        # 目标服务器设置为 active，删除源服务器（只读写一次文件）
+        with self.scanner.buffered():
+            self.scanner.update_server_status(target_ip, 'active')
+            nodes_data = self.scanner.load_nodes()
+            self.scanner.remove_server_inplace(current_ip, nodes_data)
+            self.scanner.save_nodes(nodes_data)
+        return True
+
     def cmd_feedback(self, source_ip: str):
         """
         新服务器启动后反馈状态
@@ -507,25 +726,20 @@ class HermitCrabAgent:
         Args:
             source_ip: 源服务器IP或域名
         """
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("发送迁移反馈")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         
         # 检查迁移标记
-        flag_file = os.path.join(
-            self.config['base']['install_path'],
-            'data',
-            'migration_flag.json'
-        )
+        flag_file = self.flag_file
         
         if not os.path.exists(flag_file):
             self.logger.warning("未找到迁移标记文件")
             return False
         
         # 读取标记
-        import json
-        with open(flag_file, 'r') as f:
-            flag_data = json.load(f)
+        with open(flag_file, 'rb') as f:
+            flag_data = json_loads(f.read())
         
         self.logger.info(f"迁移时间: {flag_data.get('migration_time')}")
         self.logger.info(f"源服务器: {flag_data.get('source_ip')}")
@@ -534,12 +748,13 @@ class HermitCrabAgent:
         self.logger.info(f"向源服务器发送反馈: {source_ip}")
         
         # 使用SSH发送简单的成功信号
-        feedback_cmd = f"echo 'Migration successful from {get_current_ip()}' > /tmp/hermit_crab_feedback.txt"
+        feedback_cmd = f"echo 'Migration successful from {self.current_ip}' > /tmp/hermit_crab_feedback.txt"
         
         returncode, stdout, stderr = self.migrator.execute_remote_command(
             source_ip,
             feedback_cmd
         )
+        self.migrator.close_connection(source_ip)
         
         if returncode == 0:
             self.logger.info("✅ 反馈发送成功")
@@ -548,8 +763,8 @@ class HermitCrabAgent:
             os.remove(flag_file)
             
             # 更新自己的状态到GitHub
-            if self.github.is_available():
-                current_ip = get_current_ip()
+            if self.github.available:
+                current_ip = self.current_ip
                 self.github.update_server_status(current_ip, 'active')
             
             return True
@@ -557,27 +772,83 @@ class HermitCrabAgent:
             self.logger.error(f"❌ 反馈发送失败: {stderr}")
             return False
     
+    def _seconds_until_migration(self, status: dict) -> float:
+        """
+        计算距离进入迁移阈值的秒数
+
+        Args:
+            status: monitor.get_status() 返回的状态
+
+        Returns:
+            剩余秒数，未初始化或已需要迁移时返回0
+        """
+        if not status['initialized'] or status['should_migrate']:
+            return 0
+
+        # 与 Monitor._should_migrate 使用同一换算，避免两处阈值计算不一致
+        return self.monitor.seconds_until_migration()
+
+    def _handle_stop_signal(self, signum, frame):
+        """SIGTERM/SIGHUP 处理：唤醒并结束守护进程"""
+        self.logger.info(f"收到信号 {signum}，守护进程准备停止")
+        self._stop_event.set()
+
     def cmd_daemon(self):
         """
         守护进程模式，持续监控
         """
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("Hermit Crab 守护进程启动")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
 
         check_interval = self.config['lifecycle']['check_interval']
 
-        while True:
-            try:
-                self.logger.info(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 执行检查...")
+        # 本地服务器列表在该时间内同步过则不再拉取
+        sync_ttl = max(60, check_interval // 4)
+        last_sync = 0.0
+
+        # systemctl stop 发送 SIGTERM，等待中可立即退出
+        signal.signal(signal.SIGTERM, self._handle_stop_signal)
+        signal.signal(signal.SIGHUP, self._handle_stop_signal)
 
-                # 首先从GitHub同步最新的服务器状态
-                if self.github.is_available():
-                    self.logger.debug("从GitHub同步最新服务器列表...")
-                    nodes_data = self.github.pull_nodes()
-                    if nodes_data:
-                        self.scanner.save_nodes(nodes_data)
-                        self.logger.debug("✅ 服务器列表已更新")
+        # 远离迁移阈值时放宽检查间隔（最长6小时）
+        idle_interval = max(check_interval, min(check_interval * 8, 21600))
+
+        while not self._stop_event.is_set():
+            # 以本轮开始时间计算下次检查的截止时间，检查耗时不累积漂移
+            tick_start = time.monotonic()
+            try:
+                self.logger.info("执行检查...")
+
+                # 每轮检查重新探测一次IP，本轮内的各步骤复用
+                self.refresh_ip()
+
+                # .env 修改后无需重启即可生效（未修改时直接返回缓存的配置）
+                config = get_config()
+                if config is not self.config:
+                    self._reload_config(config)
+
+                # 重试队列只由守护进程重新发送（定时任务等进程只负责入队）
+                self.notifier.serve_retry_queue()
+
+                # 距离迁移阈值超过1天时无需同步服务器列表
+                until_migration = self._seconds_until_migration(self.monitor.get_status())
+
+                # 首先从GitHub同步最新的服务器状态（本地文件较新时跳过）
+                if self.github.available and until_migration < 86400:
+                    try:
+                        last_write = os.path.getmtime(self.scanner.nodes_file)
+                    except OSError:
+                        last_write = 0.0
+                    if time.time() - max(last_write, last_sync) > sync_ttl:
+                        self.logger.debug("从GitHub同步最新服务器列表...")
+                        nodes_data = self.github.pull_nodes()
+                        if nodes_data:
+                            self.scanner.save_nodes(nodes_data)
+                            last_sync = time.time()
+                            self.logger.debug("✅ 服务器列表已更新")
+                    else:
+                        self.logger.debug("本地服务器列表较新，跳过同步")
 
                 # 检查是否需要迁移
                 if self.cmd_check():
@@ -587,15 +858,13 @@ class HermitCrabAgent:
                     success = self.cmd_migrate(auto=True)
 
                     if success:
-                        self.logger.info("=" * 60)
+                        self.logger.info(_BANNER)
                         self.logger.info("自动迁移成功！源服务器开始退役流程...")
-                        self.logger.info("=" * 60)
+                        self.logger.info(_BANNER)
 
                         # 迁移成功后，源服务器应该停止服务并退役
                         # 避免 systemd 自动重启后再次触发迁移
                         try:
-                            import subprocess
-
                             self.logger.info("正在停止 hermit-crab-daemon 服务...")
                             subprocess.run(["systemctl", "stop", "hermit-crab-daemon.service"],
                                          check=False, capture_output=True)
@@ -619,20 +888,28 @@ class HermitCrabAgent:
                     else:
                         self.logger.error("自动迁移失败，将在下次检查时重试")
 
-                self.logger.info(f"下次检查时间: {check_interval}秒后")
-                time.sleep(check_interval)
+                # 阈值内按检查间隔轮询；阈值外放宽间隔，但在到达迁移阈值时及时醒来
+                if until_migration > 0:
+                    interval = min(idle_interval, max(60, until_migration))
+                else:
+                    interval = check_interval
+                sleep_for = max(0, tick_start + interval - time.monotonic())
+                self.logger.info("下次检查时间: %.0f秒后", sleep_for)
+                self._stop_event.wait(sleep_for)
 
             except KeyboardInterrupt:
                 self.logger.info("\n收到退出信号，守护进程停止")
                 break
             except Exception as e:
                 self.logger.error(f"守护进程异常: {e}")
-                time.sleep(60)  # 发生异常后等待1分钟再继续
+                self._stop_event.wait(60)  # 发生异常后等待1分钟再继续
+
+        self.logger.info("守护进程已停止")
     
     def cmd_list(self):
         """列出所有服务器"""
         # 同步GitHub
-        if self.github.is_available():
+        if self.github.available:
             nodes_data = self.github.pull_nodes()
             if nodes_data:
                 self.scanner.save_nodes(nodes_data)
@@ -641,19 +918,13 @@ class HermitCrabAgent:
 
     def cmd_start(self):
         """启动自动迁移"""
-        import subprocess
-
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("启动自动迁移")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
 
         try:
             # 检查当前状态
-            result = subprocess.run(
-                ["systemctl", "is-active", "hermit-crab-daemon.service"],
-                capture_output=True, text=True, check=False
-            )
-            is_active = result.stdout.strip() == "active"
+            is_active = self._daemon_active()
 
             if is_active:
                 self.logger.info("✅ 自动迁移已在运行中")
@@ -662,13 +933,14 @@ class HermitCrabAgent:
             # 启动服务
             self.logger.info("正在启动 hermit-crab-daemon 服务...")
             subprocess.run(
-                ["systemctl", "enable", "--now", "hermit-crab-daemon.service"],
+                ["systemctl", "enable", "--now", DAEMON_SERVICE],
                 check=True, capture_output=True
             )
+            self._daemon_status_cache = None
 
             self.logger.info("✅ 自动迁移已启动")
             self.logger.info("系统将持续监控服务器状态并在需要时自动执行迁移")
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
 
         except subprocess.CalledProcessError as e:
             self.logger.error(f"❌ 启动失败: {e}")
@@ -679,19 +951,13 @@ class HermitCrabAgent:
 
     def cmd_stop(self):
         """停止自动迁移"""
-        import subprocess
-
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
         self.logger.info("停止自动迁移")
-        self.logger.info("=" * 60)
+        self.logger.info(_BANNER)
 
         try:
             # 检查当前状态
-            result = subprocess.run(
-                ["systemctl", "is-active", "hermit-crab-daemon.service"],
-                capture_output=True, text=True, check=False
-            )
-            is_active = result.stdout.strip() == "active"
+            is_active = self._daemon_active()
 
             if not is_active:
                 self.logger.info("✅ 自动迁移未在运行")
@@ -700,13 +966,14 @@ class HermitCrabAgent:
             # 停止服务
             self.logger.info("正在停止 hermit-crab-daemon 服务...")
             subprocess.run(
-                ["systemctl", "disable", "--now", "hermit-crab-daemon.service"],
+                ["systemctl", "disable", "--now", DAEMON_SERVICE],
                 check=True, capture_output=True
             )
+            self._daemon_status_cache = None
 
             self.logger.info("✅ 自动迁移已停止")
             self.logger.info("需要手动执行 'hermit-crab migrate' 进行迁移")
-            self.logger.info("=" * 60)
+            self.logger.info(_BANNER)
 
         except subprocess.CalledProcessError as e:
             self.logger.error(f"❌ 停止失败: {e}")
@@ -733,7 +1000,7 @@ class HermitCrabAgent:
             self.logger.info("✅ 已添加到本地列表")
 
             # 同步到GitHub
-            if self.github.is_available():
+            if self.github.available:
                 nodes_data = self.scanner.load_nodes()
                 if self.github.push_nodes(nodes_data):
                     self.logger.info("✅ 已同步到GitHub")
@@ -741,7 +1008,6 @@ class HermitCrabAgent:
                     self.logger.warning("⚠️  GitHub同步失败")
 
             # 计算过期日期
-            from datetime import datetime, timedelta
             added_date = datetime.now()
             actual_total_days = total_days if total_days is not None else self.config['lifecycle']['total_days']
             expire_date = (added_date + timedelta(days=actual_total_days)).strftime('%Y-%m-%d')
@@ -773,7 +1039,7 @@ class HermitCrabAgent:
             self.logger.info("✅ 已从本地列表删除")
 
             # 同步到GitHub
-            if self.github.is_available():
+            if self.github.available:
                 nodes_data = self.scanner.load_nodes()
                 if self.github.push_nodes(nodes_data):
                     self.logger.info("✅ 已同步到GitHub")
@@ -832,18 +1098,23 @@ def main():
     
     # init命令
     init_parser = subparsers.add_parser('init', help='初始化生命周期（系统自动记录时间）')
+    init_parser.set_defaults(func=lambda agent, args: agent.cmd_init())
 
     # update-lifecycle命令（迁移后使用）
     update_lifecycle_parser = subparsers.add_parser('update-lifecycle', help='迁移后更新生命周期（保留历史）')
     update_lifecycle_parser.add_argument('--target-ip', help='目标服务器IP（可选）')
     update_lifecycle_parser.add_argument('--old-lifecycle', help='源服务器的lifecycle JSON（可选）')
     update_lifecycle_parser.add_argument('--old-lifecycle-base64', help='源服务器的lifecycle base64编码（可选）')
+    update_lifecycle_parser.set_defaults(func=lambda agent, args: agent.cmd_update_lifecycle(
+        args.target_ip, args.old_lifecycle, args.old_lifecycle_base64))
 
     # status命令
-    subparsers.add_parser('status', help='显示当前状态')
+    subparsers.add_parser('status', help='显示当前状态').set_defaults(
+        func=lambda agent, args: agent.cmd_status())
     
     # check命令
-    subparsers.add_parser('check', help='检查是否需要迁移')
+    subparsers.add_parser('check', help='检查是否需要迁移').set_defaults(
+        func=lambda agent, args: agent.cmd_check())
     
     # migrate命令
     migrate_parser = subparsers.add_parser('migrate', help='执行迁移')
@@ -851,32 +1122,41 @@ def main():
     migrate_parser.add_argument('--password', help='SSH密码（可选，优先从环境变量读取）')
     migrate_parser.add_argument('--auto', action='store_true', help='自动选择目标')
     migrate_parser.add_argument('--force', action='store_true', help='强制迁移（忽略生命周期，选择剩余时间最长的服务器）')
+    migrate_parser.set_defaults(func=lambda agent, args: agent.cmd_migrate(
+        args.target, args.password, args.auto, args.force))
     
     # feedback命令
     feedback_parser = subparsers.add_parser('feedback', help='发送迁移反馈')
     feedback_parser.add_argument('--source', required=True, help='源服务器IP或域名')
+    feedback_parser.set_defaults(func=lambda agent, args: agent.cmd_feedback(args.source))
     
     # daemon命令
-    subparsers.add_parser('daemon', help='守护进程模式')
+    subparsers.add_parser('daemon', help='守护进程模式').set_defaults(
+        func=lambda agent, args: agent.cmd_daemon())
 
     # start命令
-    subparsers.add_parser('start', help='启动自动迁移')
+    subparsers.add_parser('start', help='启动自动迁移').set_defaults(
+        func=lambda agent, args: agent.cmd_start())
 
     # stop命令
-    subparsers.add_parser('stop', help='停止自动迁移')
+    subparsers.add_parser('stop', help='停止自动迁移').set_defaults(
+        func=lambda agent, args: agent.cmd_stop())
 
     # list命令
-    subparsers.add_parser('list', help='列出所有服务器')
+    subparsers.add_parser('list', help='列出所有服务器').set_defaults(
+        func=lambda agent, args: agent.cmd_list())
 
     # add命令
     add_parser = subparsers.add_parser('add', help='添加新服务器（系统自动记录时间）')
     add_parser.add_argument('--ip', required=True, help='服务器IP地址')
     add_parser.add_argument('--notes', default='', help='备注信息（可选）')
     add_parser.add_argument('--total-days', type=int, default=None, help='服务器生命周期天数（可选，默认20天）')
+    add_parser.set_defaults(func=lambda agent, args: agent.cmd_add_server(args.ip, args.notes, args.total_days))
 
     # remove命令
     remove_parser = subparsers.add_parser('remove', help='删除服务器')
     remove_parser.add_argument('--ip', required=True, help='服务器IP地址')
+    remove_parser.set_defaults(func=lambda agent, args: agent.cmd_remove_server(args.ip))
     
     args = parser.parse_args()
     
@@ -889,36 +1169,13 @@ def main():
     
     # 执行命令
     try:
-        if args.command == 'init':
-            agent.cmd_init()
-        elif args.command == 'update-lifecycle':
-            agent.cmd_update_lifecycle(args.target_ip, args.old_lifecycle, args.old_lifecycle_base64)
-        elif args.command == 'status':
-            agent.cmd_status()
-        elif args.command == 'check':
-            agent.cmd_check()
-        elif args.command == 'migrate':
-            agent.cmd_migrate(args.target, args.password, args.auto, args.force)
-        elif args.command == 'feedback':
-            agent.cmd_feedback(args.source)
-        elif args.command == 'daemon':
-            agent.cmd_daemon()
-        elif args.command == 'start':
-            agent.cmd_start()
-        elif args.command == 'stop':
-            agent.cmd_stop()
-        elif args.command == 'list':
-            agent.cmd_list()
-        elif args.command == 'add':
-            agent.cmd_add_server(args.ip, args.notes, args.total_days)
-        elif args.command == 'remove':
-            agent.cmd_remove_server(args.ip)
-        else:
-            parser.print_help()
-            sys.exit(1)
+        args.func(agent, args)
     except Exception as e:
         agent.logger.error(f"执行命令失败: {e}")
         sys.exit(1)
+    finally:
+        # 进程退出前发完已提交的邮件
+        agent._flush_notifications()
 
 
 if __name__ == '__main__':
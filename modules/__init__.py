@@ -6,15 +6,32 @@ Hermit Crab - 寄居蟹自动迁移系统
 __version__ = "1.0.0"
 __author__ = "Hermit Crab Team"
 
-from .monitor import Monitor
-from .scanner import Scanner
-from .migrator import Migrator
-from .initializer import Initializer
-from .github_sync import GitHubSync
-from .cloudflare_api import CloudFlareAPI
-from .notification import ResendNotifier
+import importlib
+
 from .utils import Logger, get_config, get_current_ip, load_env, get_ssh_password
 
+# 功能模块按需导入（PyGithub / requests 等依赖较重，短命令无需加载）
+_LAZY_IMPORTS = {
+    'Monitor': '.monitor',
+    'Scanner': '.scanner',
+    'Migrator': '.migrator',
+    'Initializer': '.initializer',
+    'GitHubSync': '.github_sync',
+    'CloudFlareAPI': '.cloudflare_api',
+    'ResendNotifier': '.notification',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
 __all__ = [
     'Monitor',
     'Scanner',
@@ -3,9 +3,18 @@ CloudFlare API模块
 负责更新DNS解析记录
 """
 
+import os
+import atexit
 import requests
-from typing import Dict, Optional
-from .utils import Logger, get_env_variable
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, List, Optional, Tuple
+from .utils import Logger, get_env_variable, json_loads, json_dumps
+
+try:
+    import dns.resolver
+except ImportError:  # dnspython 为可选依赖，未安装时不做权威DNS预检查
+    dns = None
 
 
 class CloudFlareAPI:
@@ -22,6 +31,9 @@ class CloudFlareAPI:
         self.logger = Logger().get_logger()
         self.enabled = config['cloudflare']['enabled']
         
+        # 是否可用（初始化完成后确定，不再变化）
+        self.available = False
+        
         if not self.enabled:
             self.logger.warning("CloudFlare DNS更新未启用")
             self.api_token = None
@@ -48,8 +60,92 @@ class CloudFlareAPI:
             "Content-Type": "application/json"
         }
         
+        # 复用HTTP会话（保持连接，避免每次请求重新TLS握手）
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # 连接池 + 对限流/网关错误自动重试（默认仅重试幂等请求）
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504])
+        ))
+        
+        # DNS记录的 ETag 缓存 {完整域名: {"etag": ..., "record": ...}}，用于条件请求
+        # 持久化到文件，供多次命令调用之间复用
+        self._etag_cache_file = os.path.join(
+            config['base']['install_path'], 'data', 'cf_etag_cache.json'
+        )
+        self._etag_cache: Dict[str, Dict] = self._load_etag_cache()
+        self._etag_cache_dirty = False
+        atexit.register(self._flush_etag_cache)
+        
+        # 权威DNS服务器IP（首次预检查时解析）
+        self._ns_ips: Optional[List[str]] = None
+        
+        self.available = True
         self.logger.info("CloudFlare API已初始化")
     
+    def _load_etag_cache(self) -> Dict[str, Dict]:
+        """
+        从文件加载 ETag 缓存
+        
+        Returns:
+            缓存字典，文件不存在或损坏时返回空字典
+        """
+        try:
+            with open(self._etag_cache_file, 'rb') as f:
+                cache = json_loads(f.read())
+            return cache if isinstance(cache, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.debug(f"加载ETag缓存失败: {e}")
+            return {}
+    
+    def _set_etag_cache(self, full_domain: str, entry: Optional[Dict]):
+        """
+        更新或删除 ETag 缓存条目并写入文件
+        
+        Args:
+            full_domain: 完整域名
+            entry: {"etag": ..., "record": ...}，为None时删除条目
+        """
+        if entry is None:
+            if self._etag_cache.pop(full_domain, None) is None:
+                return
+        else:
+            self._etag_cache[full_domain] = entry
+        self._etag_cache_dirty = True
+        self._flush_etag_cache()
+    
+    def _flush_etag_cache(self):
+        """将 ETag 缓存原子写入文件（先写临时文件再替换）"""
+        if not self._etag_cache_dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._etag_cache_file), exist_ok=True)
+            tmp_file = f"{self._etag_cache_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(json_dumps(self._etag_cache))
+            os.replace(tmp_file, self._etag_cache_file)
+            self._etag_cache_dirty = False
+        except Exception as e:
+            self.logger.debug(f"保存ETag缓存失败: {e}")
+    
+    @staticmethod
+    def _parse(response: requests.Response) -> Dict:
+        """
+        检查响应状态并解析JSON（直接从原始字节解析）
+        
+        Args:
+            response: HTTP响应
+            
+        Returns:
+            响应数据
+        """
+        response.raise_for_status()
+        return json_loads(response.content)
+    
     def is_available(self) -> bool:
         """
         检查CloudFlare是否可用
@@ -57,7 +153,7 @@ class CloudFlareAPI:
         Returns:
             是否可用
         """
-        return self.enabled and self.api_token is not None
+        return self.available
     
     def get_dns_record(self, subdomain: str) -> Optional[Dict]:
         """
@@ -69,7 +165,7 @@ class CloudFlareAPI:
         Returns:
             DNS记录信息，失败返回None
         """
-        if not self.is_available():
+        if not self.available:
             self.logger.warning("CloudFlare不可用")
             return None
         
@@ -82,13 +178,26 @@ class CloudFlareAPI:
                 "type": "A"
             }
             
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
-            response.raise_for_status()
+            # 有缓存时发送条件请求，记录未变化则返回 304（无响应体）
+            headers = None
+            cached = self._etag_cache.get(full_domain)
+            if cached:
+                headers = {"If-None-Match": cached['etag']}
             
-            data = response.json()
+            response = self.session.get(url, params=params, headers=headers, timeout=30)
+            
+            if response.status_code == 304 and cached:
+                record = cached['record']
+                self.logger.info(f"找到DNS记录(未变化): {full_domain} -> {record['content']}")
+                return record
+            
+            data = self._parse(response)
             
             if data.get('success') and data.get('result'):
                 record = data['result'][0]
+                etag = response.headers.get('ETag')
+                if etag:
+                    self._set_etag_cache(full_domain, {"etag": etag, "record": record})
                 self.logger.info(f"找到DNS记录: {full_domain} -> {record['content']}")
                 return record
             else:
@@ -113,7 +222,7 @@ class CloudFlareAPI:
         Returns:
             是否成功
         """
-        if not self.is_available():
+        if not self.available:
             return False
         
         try:
@@ -129,12 +238,11 @@ class CloudFlareAPI:
                 "proxied": False
             }
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
+            response = self.session.post(url, data=json_dumps(payload), timeout=30)
+            data = self._parse(response)
             
             if data.get('success'):
+                self._set_etag_cache(full_domain, None)
                 self.logger.info(f"✅ DNS记录已创建: {full_domain} -> {ip}")
                 return True
             else:
@@ -149,6 +257,77 @@ class CloudFlareAPI:
             self.logger.error(f"创建DNS记录异常: {e}")
             return False
     
+    def _authoritative_matches(self, subdomain: str, ip: str) -> bool:
+        """
+        向域名的权威DNS服务器查询A记录，判断是否已解析到指定IP
+        
+        一次UDP查询代替API请求；查询失败或未安装 dnspython 时返回False
+        
+        Args:
+            subdomain: 子域名
+            ip: 期望的IP地址
+            
+        Returns:
+            权威解析是否已经只指向该IP
+        """
+        if dns is None:
+            return False
+        
+        try:
+            if self._ns_ips is None:
+                ns_ips = []
+                for ns in dns.resolver.resolve(self.domain, "NS", lifetime=2.0):
+                    ns_ips.extend(r.address for r in dns.resolver.resolve(str(ns.target), "A", lifetime=2.0))
+                self._ns_ips = ns_ips
+            if not self._ns_ips:
+                return False
+            
+            resolver = dns.resolver.Resolver(configure=False)
+            resolver.nameservers = self._ns_ips
+            answer = resolver.resolve(f"{subdomain}.{self.domain}", "A", lifetime=2.0)
+            return {r.address for r in answer} == {ip}
+        except Exception as e:
+            self.logger.debug(f"权威DNS查询失败: {e}")
+            return False
+    
+    def _patch_cached_record(self, subdomain: str, new_ip: str) -> bool:
+        """
+        按缓存的记录ID直接部分更新DNS记录（只修改IP）
+        
+        Args:
+            subdomain: 子域名
+            new_ip: 新的IP地址
+            
+        Returns:
+            是否成功；无缓存或请求失败返回False，由调用方走查询+更新流程
+        """
+        full_domain = f"{subdomain}.{self.domain}"
+        cached = self._etag_cache.get(full_domain)
+        if not cached:
+            return False
+        
+        record = cached['record']
+        url = f"{self.base_url}/zones/{self.zone_id}/dns_records/{record['id']}"
+        
+        try:
+            response = self.session.patch(url, data=json_dumps({"content": new_ip}), timeout=30)
+            if response.status_code == 404:
+                self.logger.debug(f"缓存的DNS记录已不存在: {full_domain}")
+                self._set_etag_cache(full_domain, None)
+                return False
+            data = self._parse(response)
+            
+            if data.get('success'):
+                self._set_etag_cache(full_domain, None)
+                self.logger.info(f"✅ DNS记录已更新: {full_domain} {record['content']} -> {new_ip}")
+                return True
+            
+            self.logger.debug(f"按缓存ID更新DNS记录失败: {data.get('errors', [])}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.debug(f"按缓存ID更新DNS记录失败: {e}")
+        
+        return False
+    
     def update_dns_record(self, subdomain: str, new_ip: str) -> bool:
         """
         更新DNS A记录
@@ -160,10 +339,19 @@ class CloudFlareAPI:
         Returns:
             是否成功
         """
-        if not self.is_available():
+        if not self.available:
             return False
         
+        # 权威DNS已指向新IP时无需调用API
+        if self._authoritative_matches(subdomain, new_ip):
+            self.logger.info(f"DNS记录IP未变化: {new_ip}")
+            return True
+        
         try:
+            # 已缓存记录ID时直接 PATCH，省去先查询的一次请求
+            if self._patch_cached_record(subdomain, new_ip):
+                return True
+            
             # 先获取现有记录
             record = self.get_dns_record(subdomain)
             
@@ -192,12 +380,11 @@ class CloudFlareAPI:
                 "proxied": False
             }
             
-            response = requests.put(url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
+            response = self.session.put(url, data=json_dumps(payload), timeout=30)
+            data = self._parse(response)
             
             if data.get('success'):
+                self._set_etag_cache(full_domain, None)
                 self.logger.info(f"✅ DNS记录已更新: {full_domain} {current_ip} -> {new_ip}")
                 return True
             else:
@@ -212,6 +399,80 @@ class CloudFlareAPI:
             self.logger.error(f"更新DNS记录异常: {e}")
             return False
     
+    def batch_update(self, updates: List[Tuple[str, str]]) -> bool:
+        """
+        批量更新DNS A记录（一次请求提交所有修改）
+        
+        不存在的记录单独创建，IP未变化的记录跳过；批量请求失败时逐条更新
+        
+        Args:
+            updates: [(子域名, IP地址), ...]
+            
+        Returns:
+            是否全部成功
+        """
+        if not self.available:
+            return False
+        
+        success = True
+        patches = []
+        
+        for subdomain, new_ip in updates:
+            if self._authoritative_matches(subdomain, new_ip):
+                self.logger.info(f"DNS记录IP未变化: {subdomain} -> {new_ip}")
+                continue
+            
+            record = self.get_dns_record(subdomain)
+            
+            if record is None:
+                self.logger.info(f"DNS记录不存在，创建新记录: {subdomain}")
+                success = self.create_dns_record(subdomain, new_ip) and success
+            elif record['content'] == new_ip:
+                self.logger.info(f"DNS记录IP未变化: {subdomain} -> {new_ip}")
+            else:
+                patches.append((subdomain, record, new_ip))
+        
+        if not patches:
+            return success
+        
+        try:
+            url = f"{self.base_url}/zones/{self.zone_id}/dns_records/batch"
+            
+            payload = {
+                "patches": [
+                    {
+                        "id": record['id'],
+                        "type": "A",
+                        "name": f"{subdomain}.{self.domain}",
+                        "content": new_ip,
+                        "ttl": self.ttl,
+                        "proxied": False
+                    }
+                    for subdomain, record, new_ip in patches
+                ]
+            }
+            
+            response = self.session.post(url, data=json_dumps(payload), timeout=30)
+            data = self._parse(response)
+            
+            if data.get('success'):
+                for subdomain, record, new_ip in patches:
+                    self._set_etag_cache(f"{subdomain}.{self.domain}", None)
+                    self.logger.info(f"✅ DNS记录已更新: {subdomain}.{self.domain} {record['content']} -> {new_ip}")
+                return success
+            else:
+                errors = data.get('errors', [])
+                self.logger.warning(f"批量更新DNS记录失败: {errors}，改为逐条更新")
+                
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"批量更新DNS记录失败: {e}，改为逐条更新")
+        except Exception as e:
+            self.logger.warning(f"批量更新DNS记录异常: {e}，改为逐条更新")
+        
+        for subdomain, _, new_ip in patches:
+            success = self.update_dns_record(subdomain, new_ip) and success
+        return success
+    
     def delete_dns_record(self, subdomain: str) -> bool:
         """
         删除DNS记录
@@ -222,7 +483,7 @@ class CloudFlareAPI:
         Returns:
             是否成功
         """
-        if not self.is_available():
+        if not self.available:
             return False
         
         try:
@@ -235,12 +496,11 @@ class CloudFlareAPI:
             record_id = record['id']
             url = f"{self.base_url}/zones/{self.zone_id}/dns_records/{record_id}"
             
-            response = requests.delete(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
+            response = self.session.delete(url, timeout=30)
+            data = self._parse(response)
             
             if data.get('success'):
+                self._set_etag_cache(f"{subdomain}.{self.domain}", None)
                 self.logger.info(f"✅ DNS记录已删除: {subdomain}")
                 return True
             else:
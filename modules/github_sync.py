@@ -4,10 +4,25 @@ GitHub同步模块
 """
 
 import json
+import copy
+import time
 import base64
-from typing import Dict, Optional
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from functools import cached_property
+from typing import Any, Callable, Dict, Optional
 from github import Github, GithubException
-from .utils import Logger, get_env_variable, format_datetime
+from .scanner import Scanner
+from .utils import Logger, get_env_variable, format_datetime, json_loads, json_dumps
+
+
+# 提交信息模板
+_CM_UPDATE = "Update nodes.json at {}".format
+_CM_BATCH = "Update {} servers".format
+_CM_STATUS = "Update server {} status to {}".format
+_CM_LOCK = "Lock server {} for {}".format
+_CM_RELEASE = "Release lock on server {}".format
 
 
 class GitHubSync:
@@ -23,11 +38,30 @@ class GitHubSync:
         self.config = config
         self.logger = Logger().get_logger()
         self.enabled = config['github']['enabled']
+
+        # 是否已启用且配置了Token（初始化完成后确定，不再变化）
+        self._configured = False
+
+        # 仓库是否可访问（首次使用时校验一次，本进程内不再变化；None 表示尚未校验）
+        self._repo_ok = None
+
+        # pull_nodes 结果缓存（TTL内重复拉取直接复用）
+        self.cache_ttl = config['github'].get('cache_ttl', 10)
+        self._nodes_cache = None
+        self._nodes_cache_time = 0.0
+
+        # 上次拉取响应的 ETag（用于条件请求）
+        self._nodes_etag = None
+
+        # 各限流资源（core/graphql）的剩余配额与重置时间，取自响应头
+        self._rate_limits = {}
+        
+        # GraphQL 推送使用的分支名及分支头提交（首次推送时查询）
+        self._branch_name = None
+        self._branch_oid = None
         
         if not self.enabled:
             self.logger.warning("GitHub同步未启用")
-            self.github = None
-            self.repo = None
             return
         
         # 获取GitHub Token
@@ -36,20 +70,69 @@ class GitHubSync:
         
         if not self.token:
             self.logger.warning(f"GitHub Token未设置 (环境变量: {token_env})")
-            self.github = None
-            self.repo = None
             return
         
+        # 原始内容拉取和GraphQL推送共用的持久会话（复用TLS连接）
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {self.token}"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+        self.session.hooks['response'].append(self._record_rate_limit)
+        
+        self.nodes_file = config['github']['nodes_file']
+        self._configured = True
+
+    @property
+    def available(self) -> bool:
+        """
+        GitHub是否可用（已启用、配置了Token且仓库可访问）
+
+        仓库只在首次访问时校验一次并缓存结果：仓库不存在、Token无权限或无法连接时，
+        本次运行（命令或守护进程）使用本地模式，避免每次访问都等待网络超时，
+        也避免同一次迁移中途切换模式
+        """
+        if not self._configured:
+            return False
+        if self._repo_ok is None:
+            self._repo_ok = self._check_repo()
+        return self._repo_ok
+
+    def _check_repo(self) -> bool:
+        """
+        校验仓库是否存在且Token有权限访问
+
+        Returns:
+            是否可访问（网络错误、限流等无法确认时也视为不可访问）
+        """
+        repo_name = self.config['github']['repo']
         try:
-            self.github = Github(self.token)
-            repo_name = config['github']['repo']
-            self.repo = self.github.get_repo(repo_name)
-            self.nodes_file = config['github']['nodes_file']
-            self.logger.info(f"GitHub仓库已连接: {repo_name}")
-        except GithubException as e:
-            self.logger.error(f"GitHub连接失败: {e}")
-            self.github = None
-            self.repo = None
+            response = self.session.get(f"https://api.github.com/repos/{repo_name}", timeout=30)
+        except requests.exceptions.RequestException as e:
+            self.logger.warning("GitHub仓库校验失败，使用本地模式: %s", e)
+            return False
+
+        if response.status_code in (401, 404):
+            self.logger.warning("GitHub仓库不可访问 (%s): %s，使用本地模式", response.status_code, repo_name)
+            return False
+        if not response.ok:
+            self.logger.warning("GitHub仓库校验失败 (%s)，使用本地模式", response.status_code)
+            return False
+        return True
+    
+    @cached_property
+    def repo(self):
+        """
+        PyGithub仓库对象（首次使用时连接）
+
+        仅 REST 回退路径需要；拉取和 GraphQL 推送不依赖它，
+        因此不在初始化时阻塞一次网络请求
+
+        Raises:
+            GithubException: 连接失败（由调用方捕获并记录）
+        """
+        repo_name = self.config['github']['repo']
+        repo = Github(self.token).get_repo(repo_name)
+        self.logger.info(f"GitHub仓库已连接: {repo_name}")
+        return repo
     
     def is_available(self) -> bool:
         """
@@ -58,36 +141,109 @@ class GitHubSync:
         Returns:
             是否可用
         """
-        return self.enabled and self.github is not None and self.repo is not None
+        return self.available
     
-    def pull_nodes(self) -> Optional[Dict]:
+    def _record_rate_limit(self, response, *args, **kwargs):
+        """记录响应头中的限流配额（requests 响应钩子）"""
+        headers = response.headers
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        try:
+            resource = headers.get('X-RateLimit-Resource', 'core')
+            self._rate_limits[resource] = (
+                int(headers['X-RateLimit-Remaining']),
+                int(headers.get('X-RateLimit-Reset', 0))
+            )
+        except ValueError:
+            pass
+
+    def _throttle(self, resource: str = 'core', threshold: int = 100, max_delay: float = 5.0):
+        """
+        配额即将耗尽时提前放慢请求
+
+        剩余配额低于阈值时，把到重置时间为止的时间均摊到剩余请求上，
+        多个节点共用同一Token时避免集中触发 403；单次等待不超过 max_delay，
+        不会在迁移或守护进程检查中长时间阻塞（配额真正耗尽时由调用方的错误处理兜底）
+
+        Args:
+            resource: 限流资源（core/graphql）
+            threshold: 开始限速的剩余配额
+            max_delay: 单次最长等待秒数
+        """
+        if resource not in self._rate_limits:
+            return
+        remaining, reset = self._rate_limits[resource]
+        if remaining >= threshold:
+            return
+
+        delay = min(max_delay, max(0.0, reset - time.time()) / max(1, remaining))
+        if delay > 0:
+            self.logger.warning("GitHub API 配额剩余 %d，%.1f秒后继续", remaining, delay)
+            time.sleep(delay)
+
+    def _update_cache(self, nodes_data: Dict):
+        """更新服务器列表缓存"""
+        self._nodes_cache = copy.deepcopy(nodes_data)
+        self._nodes_cache_time = time.monotonic()
+
+    def pull_nodes(self, force: bool = False) -> Optional[Dict]:
         """
         从GitHub拉取服务器列表
+
+        Args:
+            force: 是否忽略缓存强制拉取（读-改-写操作必须强制拉取）
         
         Returns:
             服务器列表字典，失败返回None
         """
-        if not self.is_available():
+        if not self.available:
             self.logger.warning("GitHub不可用，无法拉取")
             return None
+
+        # TTL内直接返回缓存副本（调用方可能修改返回值）
+        if (not force and self._nodes_cache is not None
+                and time.monotonic() - self._nodes_cache_time < self.cache_ttl):
+            self.logger.debug("使用缓存的服务器列表")
+            return copy.deepcopy(self._nodes_cache)
         
         try:
             self.logger.info(f"从GitHub拉取: {self.nodes_file}")
             
-            # 获取文件内容
-            file_content = self.repo.get_contents(self.nodes_file)
-            content = file_content.decoded_content.decode('utf-8')
+            # 直接获取原始文件内容（无需 base64 解码）
+            headers = {"Accept": "application/vnd.github.raw"}
+            # 条件请求（If-None-Match）：文件未变化时返回 304，不下载内容
+            if self._nodes_etag and self._nodes_cache is not None:
+                headers["If-None-Match"] = self._nodes_etag
+            
+            self._throttle('core')
+            response = self.session.get(
+                f"https://api.github.com/repos/{self.config['github']['repo']}/contents/{self.nodes_file}",
+                headers=headers,
+                timeout=30
+            )
+            
+            if response.status_code == 304:
+                self._nodes_cache_time = time.monotonic()
+                self.logger.info("✅ 服务器列表未变化，使用缓存")
+                return copy.deepcopy(self._nodes_cache)
+            
+            if response.status_code == 404:
+                self._nodes_etag = None
+                self.logger.warning(f"文件不存在: {self.nodes_file}")
+                return None
             
-            nodes_data = json.loads(content)
+            response.raise_for_status()
+            
+            nodes_data = json_loads(response.content)
+            self._nodes_etag = response.headers.get('ETag')
+            self._update_cache(nodes_data)
             self.logger.info(f"✅ 成功拉取服务器列表 ({len(nodes_data.get('servers', []))} 个服务器)")
             
             return nodes_data
             
-        except GithubException as e:
-            if e.status == 404:
-                self.logger.warning(f"文件不存在: {self.nodes_file}")
-            else:
-                self.logger.error(f"GitHub拉取失败: {e}")
+        except requests.exceptions.RequestException as e:
+            self._nodes_etag = None
+            self.logger.error(f"GitHub拉取失败: {e}")
             return None
         except json.JSONDecodeError as e:
             self.logger.error(f"JSON解析失败: {e}")
@@ -96,6 +252,81 @@ class GitHubSync:
             self.logger.error(f"拉取异常: {e}")
             return None
     
+    def _gql(self, query: str, variables: Dict) -> Dict[str, Any]:
+        """
+        执行GitHub GraphQL请求
+
+        Args:
+            query: GraphQL 查询/变更
+            variables: 变量
+
+        Returns:
+            响应中的 data 字段
+
+        Raises:
+            RuntimeError: 请求返回错误
+        """
+        self._throttle('graphql')
+        response = self.session.post(
+            "https://api.github.com/graphql",
+            json={"query": query, "variables": variables},
+            timeout=30
+        )
+        response.raise_for_status()
+        result = response.json()
+        if result.get('errors'):
+            raise RuntimeError(result['errors'])
+        return result['data']
+
+    def _refresh_branch_head(self):
+        """查询默认分支名及其最新提交"""
+        owner, name = self.config['github']['repo'].split('/', 1)
+        data = self._gql(
+            "query($owner: String!, $name: String!) {"
+            " repository(owner: $owner, name: $name) {"
+            " defaultBranchRef { name target { oid } } } }",
+            {"owner": owner, "name": name}
+        )
+        ref = data['repository']['defaultBranchRef']
+        self._branch_name = ref['name']
+        self._branch_oid = ref['target']['oid']
+
+    def _commit_file_graphql(self, content: bytes, commit_message: str):
+        """
+        通过 createCommitOnBranch 单次请求提交文件（创建或覆盖）
+
+        以缓存的分支头作为 expectedHeadOid；分支已前进时刷新后重试一次
+
+        Args:
+            content: 文件内容（UTF-8 字节串）
+            commit_message: 提交信息
+        """
+        mutation = (
+            "mutation($input: CreateCommitOnBranchInput!) {"
+            " createCommitOnBranch(input: $input) { commit { oid } } }"
+        )
+        encoded = base64.b64encode(content).decode('ascii')
+
+        for attempt in range(2):
+            if self._branch_oid is None or attempt > 0:
+                self._refresh_branch_head()
+            try:
+                data = self._gql(mutation, {"input": {
+                    "branch": {
+                        "repositoryNameWithOwner": self.config['github']['repo'],
+                        "branchName": self._branch_name,
+                    },
+                    "message": {"headline": commit_message},
+                    "fileChanges": {"additions": [{"path": self.nodes_file, "contents": encoded}]},
+                    "expectedHeadOid": self._branch_oid,
+                }})
+            except RuntimeError:
+                if attempt > 0:
+                    raise
+                continue
+            self._branch_oid = data['createCommitOnBranch']['commit']['oid']
+            return
+
     def push_nodes(self, nodes_data: Dict, commit_message: Optional[str] = None) -> bool:
         """
         推送服务器列表到GitHub
@@ -107,13 +338,13 @@ class GitHubSync:
         Returns:
             是否成功
         """
-        if not self.is_available():
+        if not self.available:
             self.logger.warning("GitHub不可用，无法推送")
             return False
         
         try:
             if commit_message is None:
-                commit_message = f"Update nodes.json at {format_datetime()}"
+                commit_message = _CM_UPDATE(format_datetime())
             
             self.logger.info("推送服务器列表到GitHub...")
             
@@ -121,7 +352,17 @@ class GitHubSync:
             nodes_data['last_updated'] = format_datetime()
             
             # 转换为JSON
-            content = json.dumps(nodes_data, indent=2, ensure_ascii=False)
+            content = json_dumps(nodes_data, indent=True)
+            
+            # 优先使用 GraphQL 单次请求提交（无需先查询文件SHA）
+            try:
+                self._commit_file_graphql(content, commit_message)
+                self.logger.info("✅ 服务器列表已更新到GitHub")
+                self._update_cache(nodes_data)
+                return True
+            except Exception as e:
+                self._branch_oid = None
+                self.logger.debug(f"GraphQL推送失败，改用REST接口: {e}")
             
             # 检查文件是否存在
             try:
@@ -145,7 +386,8 @@ class GitHubSync:
                     self.logger.info("✅ 服务器列表已创建到GitHub")
                 else:
                     raise
-            
+
+            self._update_cache(nodes_data)
             return True
             
         except GithubException as e:
@@ -155,113 +397,215 @@ class GitHubSync:
             self.logger.error(f"推送异常: {e}")
             return False
     
-    def update_server_status(self, ip: str, status: str, **kwargs) -> bool:
+    @staticmethod
+    def _rate_limit_wait(e: GithubException, max_wait: float = 60.0) -> Optional[float]:
         """
-        更新单个服务器状态并推送到GitHub
+        根据限流响应头计算需要等待的秒数
+
+        Args:
+            e: GitHub异常
+            max_wait: 最长等待时间，超过则不等待
+
+        Returns:
+            等待秒数；不是限流错误或需要等待过久时返回None
+        """
+        if e.status not in (403, 429):
+            return None
+
+        headers = {k.lower(): v for k, v in (e.headers or {}).items()}
+        if 'retry-after' in headers:
+            wait = float(headers['retry-after'])
+        elif headers.get('x-ratelimit-remaining') == '0' and 'x-ratelimit-reset' in headers:
+            wait = float(headers['x-ratelimit-reset']) - time.time() + 1
+        else:
+            return None
+
+        if wait > max_wait:
+            return None
+        return max(wait, 0.0)
+
+    def mutate_nodes(self, mutator: Callable[[Dict], Optional[bool]],
+                     commit_message: str, max_retries: int = 3) -> bool:
+        """
+        对服务器列表执行一次读-改-写（单次提交）
+
+        基于文件SHA的乐观并发控制：如果期间有其他服务器推送导致冲突，
+        重新拉取最新内容并重试
+
+        Args:
+            mutator: 原地修改 nodes_data 的函数，返回 False 表示放弃提交
+            commit_message: 提交信息
+            max_retries: 冲突时的最大尝试次数
+
+        Returns:
+            是否成功
+        """
+        if not self.available:
+            self.logger.warning("GitHub不可用，无法推送")
+            return False
+
+        delay = 0.05
+        for attempt in range(1, max_retries + 1):
+            try:
+                file_content = self.repo.get_contents(self.nodes_file)
+                nodes_data = json_loads(file_content.decoded_content)
+
+                if mutator(nodes_data) is False:
+                    return False
+
+                nodes_data['last_updated'] = format_datetime()
+                content = json_dumps(nodes_data, indent=True)
+
+                self.repo.update_file(
+                    path=self.nodes_file,
+                    message=commit_message,
+                    content=content,
+                    sha=file_content.sha
+                )
+                self._update_cache(nodes_data)
+                self.logger.info("✅ 服务器列表已更新到GitHub")
+                return True
+
+            except GithubException as e:
+                if e.status == 409 and attempt < max_retries:
+                    # 退避并加随机抖动，避免多个节点同步重试
+                    delay = min(5.0, random.uniform(0.05, delay * 3))
+                    self.logger.warning(f"服务器列表已被其他节点修改，{delay:.2f}秒后重试 ({attempt}/{max_retries})...")
+                    time.sleep(delay)
+                    continue
+                wait = self._rate_limit_wait(e)
+                if wait is not None and attempt < max_retries:
+                    self.logger.warning(f"GitHub API 限流，{wait:.0f}秒后重试 ({attempt}/{max_retries})...")
+                    time.sleep(wait)
+                    continue
+                self.logger.error(f"GitHub推送失败: {e}")
+                return False
+            except Exception as e:
+                self.logger.error(f"推送异常: {e}")
+                return False
+
+        return False
+
+    def batch_update_servers(self, updates: Dict[str, Dict[str, Any]],
+                             commit_message: Optional[str] = None) -> bool:
+        """
+        批量更新多个服务器的字段（一次拉取、一次提交）
         
         Args:
-            ip: 服务器IP地址
-            status: 新状态
-            **kwargs: 其他要更新的字段
+            updates: {ip: {字段: 值}}，值为 None 表示删除该字段
+            commit_message: 提交信息，默认按更新数量生成
             
         Returns:
             是否成功
         """
-        if not self.is_available():
+        if not self.available:
             self.logger.warning("GitHub不可用")
             return False
         
-        # 先拉取最新数据
-        nodes_data = self.pull_nodes()
-        if nodes_data is None:
-            return False
-        
-        # 查找并更新服务器
-        servers = nodes_data.get('servers', [])
-        updated = False
+        if not updates:
+            return True
         
-        for server in servers:
-            if server.get('ip') == ip:
-                server['status'] = status
-                server['last_heartbeat'] = format_datetime()
-                
-                # 更新其他字段
-                for key, value in kwargs.items():
-                    server[key] = value
-                
-                updated = True
-                self.logger.info(f"服务器 {ip} 状态已更新: {status}")
-                break
+        def apply_updates(nodes_data):
+            servers_by_ip = Scanner.index_by_ip(nodes_data)
+            
+            missing = [ip for ip in updates if ip not in servers_by_ip]
+            if missing:
+                self.logger.warning(f"未找到服务器: {', '.join(missing)}")
+                return False
+            
+            now = format_datetime()
+            for ip, fields in updates.items():
+                server = servers_by_ip[ip]
+                for key, value in fields.items():
+                    if value is None:
+                        server.pop(key, None)
+                    else:
+                        server[key] = value
+                server['last_heartbeat'] = now
         
-        if not updated:
-            self.logger.warning(f"未找到服务器: {ip}")
-            return False
+        if commit_message is None:
+            commit_message = _CM_BATCH(len(updates))
+        return self.mutate_nodes(apply_updates, commit_message)
+    
+    def update_server_status(self, ip: str, status: str, **kwargs) -> bool:
+        """
+        更新单个服务器状态并推送到GitHub
         
-        # 推送更新
-        commit_msg = f"Update server {ip} status to {status}"
-        return self.push_nodes(nodes_data, commit_msg)
+        Args:
+            ip: 服务器IP地址
+            status: 新状态
+            **kwargs: 其他要更新的字段
+            
+        Returns:
+            是否成功
+        """
+        commit_msg = _CM_STATUS(ip, status)
+        if self.batch_update_servers({ip: {'status': status, **kwargs}}, commit_msg):
+            self.logger.info(f"服务器 {ip} 状态已更新: {status}")
+            return True
+        return False
     
-    def acquire_lock(self, ip: str, lock_holder: str) -> bool:
+    def acquire_lock(self, ip: str, lock_holder: str, max_retries: int = 8,
+                     base: float = 0.05, cap: float = 5.0) -> bool:
         """
         获取服务器锁（防止并发迁移到同一服务器）
         
-        使用GitHub API的原子性来实现分布式锁
+        使用GitHub API的原子性来实现分布式锁；服务器已被锁定时
+        按指数退避（带随机抖动）重试
         
         Args:
             ip: 服务器IP地址
             lock_holder: 锁持有者标识
+            max_retries: 最大尝试次数
+            base: 初始退避时间（秒）
+            cap: 最长退避时间（秒）
             
         Returns:
             是否成功获取锁
         """
-        if not self.is_available():
+        if not self.available:
             self.logger.warning("GitHub不可用，无法获取锁")
             return False
         
-        try:
-            # 拉取最新数据
-            nodes_data = self.pull_nodes()
-            if nodes_data is None:
-                return False
-            
-            # 查找服务器
-            servers = nodes_data.get('servers', [])
-            target_server = None
-            
-            for server in servers:
-                if server.get('ip') == ip:
-                    target_server = server
-                    break
+        # 本次尝试失败是否因为已被锁定（仅此情况值得重试）
+        contention = {'locked': False}
+        
+        def lock_server(nodes_data):
+            contention['locked'] = False
             
+            target_server = Scanner.index_by_ip(nodes_data).get(ip)
             if target_server is None:
                 self.logger.error(f"服务器不存在: {ip}")
                 return False
             
             # 检查锁状态
-            current_status = target_server.get('status')
-            
-            if current_status == 'transferring':
+            if target_server.get('status') == 'transferring':
                 self.logger.warning(f"服务器 {ip} 已被锁定")
+                contention['locked'] = True
                 return False
             
             # 尝试获取锁
             target_server['status'] = 'transferring'
             target_server['lock_holder'] = lock_holder
             target_server['lock_time'] = format_datetime()
-            
-            # 推送更新
-            commit_msg = f"Lock server {ip} for {lock_holder}"
-            
-            if self.push_nodes(nodes_data, commit_msg):
+        
+        # 读取与写入基于同一文件SHA，其他节点抢先修改时提交冲突并重新检查锁状态
+        commit_msg = _CM_LOCK(ip, lock_holder)
+        delay = base
+        for attempt in range(1, max_retries + 1):
+            if self.mutate_nodes(lock_server, commit_msg):
                 self.logger.info(f"✅ 成功获取服务器锁: {ip}")
                 return True
-            else:
-                self.logger.error("推送锁定状态失败")
+            
+            # 服务器不存在、网络或认证错误不重试
+            if not contention['locked'] or attempt == max_retries:
                 return False
-                
-        except Exception as e:
-            self.logger.error(f"获取锁异常: {e}")
-            return False
+            
+            delay = min(cap, random.uniform(base, delay * 3))
+            self.logger.info(f"{delay:.2f}秒后重试获取锁 ({attempt}/{max_retries})...")
+            time.sleep(delay)
+        
+        return False
     
     def release_lock(self, ip: str, new_status: str = 'active') -> bool:
         """
@@ -274,32 +618,13 @@ class GitHubSync:
         Returns:
             是否成功
         """
-        if not self.is_available():
+        if not self.available:
             return False
         
-        try:
-            nodes_data = self.pull_nodes()
-            if nodes_data is None:
-                return False
-            
-            servers = nodes_data.get('servers', [])
-            
-            for server in servers:
-                if server.get('ip') == ip:
-                    server['status'] = new_status
-                    server.pop('lock_holder', None)
-                    server.pop('lock_time', None)
-                    
-                    commit_msg = f"Release lock on server {ip}"
-                    
-                    if self.push_nodes(nodes_data, commit_msg):
-                        self.logger.info(f"✅ 已释放服务器锁: {ip}")
-                        return True
-                    break
-            
-            return False
-            
-        except Exception as e:
-            self.logger.error(f"释放锁异常: {e}")
-            return False
+        commit_msg = _CM_RELEASE(ip)
+        fields = {'status': new_status, 'lock_holder': None, 'lock_time': None}
+        if self.batch_update_servers({ip: fields}, commit_msg):
+            self.logger.info(f"✅ 已释放服务器锁: {ip}")
+            return True
+        return False
 
@@ -5,8 +5,13 @@
 
 import os
 import time
+import base64
+import random
+import socket
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
-from .utils import Logger, format_datetime
+from .utils import Logger, format_datetime, json_loads, json_dumps
 
 
 class Initializer:
@@ -42,31 +47,36 @@ class Initializer:
             f"{self.install_path}/data/nodes.json"
         ]
 
+        existing_files = []
         for config_file in config_files:
-            if not os.path.exists(config_file):
-                self.logger.warning(f"配置文件不存在: {config_file}")
-                continue
-
-            # 使用scp传输（确保最新版本）
-            cmd = (
-                f"scp -i {migrator.ssh_key} -o StrictHostKeyChecking=no "
-                f"{config_file} {migrator.ssh_user}@{target_ip}:{config_file}"
-            )
-
-            import subprocess
-            result = subprocess.run(
-                cmd,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-
-            if result.returncode == 0:
-                self.logger.info(f"✅ 已同步: {config_file}")
+            if os.path.exists(config_file):
+                existing_files.append(config_file)
             else:
-                self.logger.error(f"❌ 同步失败: {config_file}, 错误: {result.stderr}")
-                return False
+                self.logger.warning(f"配置文件不存在: {config_file}")
+
+        if not existing_files:
+            return True
+
+        # 一次rsync传输全部文件（-R 保留绝对路径，未变化的文件不重传）
+        cmd = [
+            'rsync', '-azR',
+            '-e', f"ssh {migrator.ssh_opts(target_ip)}",
+            *existing_files,
+            f"{migrator.ssh_user}@{target_ip}:/"
+        ]
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=60
+        )
+
+        if result.returncode != 0:
+            self.logger.error(f"❌ 同步失败: {', '.join(existing_files)}, 错误: {result.stderr}")
+            return False
+
+        for config_file in existing_files:
+            self.logger.info(f"✅ 已同步: {config_file}")
 
         return True
     
@@ -85,19 +95,16 @@ class Initializer:
         self.logger.info("更新目标服务器生命周期信息...")
 
         # 读取当前（源服务器）的lifecycle，传递给目标服务器
-        import json
-        import os
-        import base64
 
         lifecycle_file = os.path.join(self.install_path, 'data', 'lifecycle.json')
         old_lifecycle_base64 = ""
 
         if os.path.exists(lifecycle_file):
-            with open(lifecycle_file, 'r', encoding='utf-8') as f:
-                old_lifecycle_data = json.load(f)
-                old_lifecycle_json = json.dumps(old_lifecycle_data)
+            with open(lifecycle_file, 'rb') as f:
+                old_lifecycle_data = json_loads(f.read())
+                old_lifecycle_json = json_dumps(old_lifecycle_data)
                 # 使用base64编码传递，避免shell解析问题
-                old_lifecycle_base64 = base64.b64encode(old_lifecycle_json.encode('utf-8')).decode('ascii')
+                old_lifecycle_base64 = base64.b64encode(old_lifecycle_json).decode('ascii')
                 self.logger.info(f"读取源服务器lifecycle，包含 {len(old_lifecycle_data.get('migration_history', []))} 条迁移历史")
 
         # 使用虚拟环境的 Python，调用update-lifecycle命令
@@ -130,7 +137,6 @@ class Initializer:
         # 如果需要等待，先等待一段时间确保GitHub已更新
         if wait_seconds > 0:
             self.logger.info(f"等待 {wait_seconds} 秒确保GitHub数据已更新...")
-            import time
             time.sleep(wait_seconds)
 
         self.logger.info("从GitHub同步最新服务器列表到目标服务器...")
@@ -161,21 +167,16 @@ class Initializer:
         """
         self.logger.info("配置目标服务器systemd服务...")
         
-        commands = [
-            # 创建systemd服务文件已经通过rsync复制过去了
-            # 重新加载systemd
-            "systemctl daemon-reload",
-            # 启用服务
-            "systemctl enable hermit-crab.service",
-            # 启用定时器
-            "systemctl enable hermit-crab.timer",
-        ]
+        # systemd服务文件已经通过rsync复制过去了
+        # 重新加载systemd并启用服务和定时器（一次SSH调用，前一步失败不影响后一步）
+        cmd = (
+            "systemctl daemon-reload; "
+            "systemctl enable hermit-crab.service hermit-crab.timer"
+        )
         
-        for cmd in commands:
-            returncode, _, stderr = migrator.execute_remote_command(target_ip, cmd)
-
-            if returncode != 0:
-                self.logger.warning(f"命令执行警告: {cmd}, 错误: {stderr}")
+        returncode, _, stderr = migrator.execute_remote_command(target_ip, cmd)
+        if returncode != 0:
+            self.logger.warning(f"命令执行警告: {cmd}, 错误: {stderr}")
         
         self.logger.info("✅ Systemd服务配置完成")
         return True
@@ -197,17 +198,18 @@ class Initializer:
         from .utils import get_current_ip
         source_ip = get_current_ip()
 
-        # 使用cat heredoc避免JSON特殊字符问题
-        cmd = f"""cat > {self.install_path}/data/migration_flag.json << EOFMARKER
-{{
-    "migrated": true,
-    "migration_time": "{format_datetime()}",
-    "source_ip": "{source_ip}",
-    "target_ip": "{target_ip}"
-}}
-EOFMARKER"""
-
-        returncode, _, stderr = migrator.execute_remote_command(target_ip, cmd)
+        flag = {
+            "migrated": True,
+            "migration_time": format_datetime(),
+            "source_ip": source_ip,
+            "target_ip": target_ip
+        }
+
+        # 经SSH标准输入写入，避免JSON特殊字符被shell解析
+        flag_file = f"{self.install_path}/data/migration_flag.json"
+        returncode, _, stderr = migrator.write_remote_file(
+            target_ip, flag_file, json_dumps(flag, indent=True)
+        )
         
         if returncode == 0:
             self.logger.info("✅ 迁移标记已创建")
@@ -239,15 +241,44 @@ EOFMARKER"""
 
         returncode, _, stderr = migrator.execute_remote_command(target_ip, cmd)
 
+        # 服务器即将重启，关闭复用连接，避免后续命令走已失效的连接
+        migrator.close_connection(target_ip)
+
         if returncode == 0:
             self.logger.info("✅ 重启命令已发送")
             self.logger.info("⏳ 等待服务器重启...")
-            time.sleep(10)
+            self._wait_for_ssh_down(target_ip)
             return True
         else:
             self.logger.error(f"❌ 重启命令失败: {stderr}")
             return False
     
+    def _wait_for_ssh_down(self, target_ip: str, max_wait: int = 30) -> bool:
+        """
+        等待目标服务器的SSH端口关闭（确认重启已开始）
+
+        避免在旧的sshd仍在运行时就判定服务器已上线
+
+        Args:
+            target_ip: 目标服务器IP
+            max_wait: 最大等待时间（秒）
+
+        Returns:
+            端口是否已关闭
+        """
+        deadline = time.time() + max_wait
+        while time.time() < deadline:
+            try:
+                with socket.create_connection((target_ip, 22), timeout=1):
+                    pass
+            except OSError:
+                self.logger.info("目标服务器已开始重启")
+                return True
+            time.sleep(1)
+
+        self.logger.warning(f"⚠️  {max_wait}秒内未检测到SSH端口关闭，继续等待上线")
+        return False
+
     def wait_for_target_online(self, target_ip: str, migrator, 
                                max_wait: int = 300, check_interval: int = 10) -> bool:
         """
@@ -257,7 +288,7 @@ EOFMARKER"""
             target_ip: 目标服务器IP
             migrator: Migrator实例
             max_wait: 最大等待时间（秒）
-            check_interval: 检查间隔（秒）
+            check_interval: 最长检查间隔（秒）
             
         Returns:
             是否成功上线
@@ -265,15 +296,20 @@ EOFMARKER"""
         self.logger.info(f"等待目标服务器上线 (最多等待 {max_wait} 秒)...")
         
         start_time = time.time()
+        deadline = start_time + max_wait
+        interval = 1.0
         
-        while time.time() - start_time < max_wait:
+        while time.time() < deadline:
             if migrator.test_ssh_connection(target_ip):
                 elapsed = time.time() - start_time
                 self.logger.info(f"✅ 目标服务器已上线 (耗时: {elapsed:.0f}秒)")
                 return True
             
-            self.logger.debug(f"服务器未响应，{check_interval}秒后重试...")
-            time.sleep(check_interval)
+            # 从1秒开始指数退避（带抖动），最长不超过 check_interval
+            delay = min(interval * (0.5 + random.random() * 0.5), max(0.0, deadline - time.time()))
+            self.logger.debug(f"服务器未响应，{delay:.1f}秒后重试...")
+            time.sleep(delay)
+            interval = min(check_interval, interval * 1.5)
         
         self.logger.error(f"❌ 等待超时，服务器未能在 {max_wait} 秒内上线")
         return False
@@ -291,16 +327,19 @@ EOFMARKER"""
         """
         self.logger.info("验证目标服务器服务状态...")
         
-        check_commands = [
-            ("Hermit Crab服务", "systemctl is-active hermit-crab.service"),
-            ("Hermit Crab定时器", "systemctl is-active hermit-crab.timer"),
+        units = [
+            ("Hermit Crab服务", "hermit-crab.service"),
+            ("Hermit Crab定时器", "hermit-crab.timer"),
         ]
         
+        # 一次调用查询所有单元，每个单元输出一行状态
+        cmd = "systemctl is-active " + " ".join(unit for _, unit in units)
+        _, stdout, _ = migrator.execute_remote_command(target_ip, cmd)
+        states = stdout.split()
+        
         all_ok = True
-        for name, cmd in check_commands:
-            returncode, stdout, _ = migrator.execute_remote_command(target_ip, cmd)
-
-            if returncode == 0 and 'active' in stdout:
+        for i, (name, _) in enumerate(units):
+            if i < len(states) and states[i] == 'active':
                 self.logger.info(f"✅ {name}: 运行中")
             else:
                 self.logger.warning(f"⚠️  {name}: 未运行")
@@ -308,6 +347,28 @@ EOFMARKER"""
         
         return all_ok
     
+    def _prepare_config_on_target(self, target_ip: str, target_server: Dict, migrator) -> bool:
+        """
+        同步配置并更新生命周期（有先后依赖，需顺序执行）
+
+        Args:
+            target_ip: 目标服务器IP
+            target_server: 目标服务器信息
+            migrator: Migrator实例
+
+        Returns:
+            是否成功
+        """
+        if not self.sync_config_to_target(target_ip, migrator):
+            return False
+
+        if not self.update_lifecycle_on_target(target_ip, target_server, migrator):
+            return False
+
+        # 从GitHub同步最新的nodes.json（重启前，失败不影响迁移）
+        self.sync_from_github_on_target(target_ip, migrator)
+        return True
+
     def initialize_target_server(self, target_ip: str, target_server: Dict, migrator) -> bool:
         """
         完整初始化目标服务器
@@ -327,23 +388,19 @@ EOFMARKER"""
         self.logger.info("=" * 60)
 
         try:
-            # 1. 同步配置文件
-            if not self.sync_config_to_target(target_ip, migrator):
-                return False
-
-            # 2. 更新生命周期（保留迁移历史）
-            if not self.update_lifecycle_on_target(target_ip, target_server, migrator):
-                return False
-
-            # 3. 从GitHub同步最新的nodes.json（重启前）
-            self.sync_from_github_on_target(target_ip, migrator)
-
-            # 4. 配置systemd服务
-            if not self.setup_systemd_service_on_target(target_ip, migrator):
-                return False
-
-            # 5. 创建迁移标记
-            if not self.create_migration_flag(target_ip, migrator):
+            # 1-5. 重启前的准备步骤：配置链路与systemd配置、迁移标记互不依赖，并行执行
+            #   a) 同步配置文件 → 更新生命周期（保留迁移历史）→ 从GitHub同步最新的nodes.json
+            #   b) 配置systemd服务
+            #   c) 创建迁移标记
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    executor.submit(self._prepare_config_on_target, target_ip, target_server, migrator),
+                    executor.submit(self.setup_systemd_service_on_target, target_ip, migrator),
+                    executor.submit(self.create_migration_flag, target_ip, migrator),
+                ]
+                results = [future.result() for future in futures]
+
+            if not all(results):
                 return False
 
             # 6. 重启目标服务器
@@ -373,3 +430,7 @@ EOFMARKER"""
             self.logger.error(f"初始化过程中发生异常: {e}")
             return False
 
+        finally:
+            # 释放复用连接（重启时已关闭的不会重复关闭）
+            migrator.close_connection(target_ip)
+
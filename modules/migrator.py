@@ -4,11 +4,16 @@
 """
 
 import os
+import sys
 import time
+import atexit
 import subprocess
 import shlex
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
-from .utils import Logger, run_command, check_command_exists, install_package
+from .utils import Logger, run_command, check_command_exists, install_packages, json_loads, json_dumps
 
 
 class Migrator:
@@ -25,6 +30,16 @@ class Migrator:
         self.logger = Logger().get_logger()
         self.ssh_user = config['security']['ssh_user']
         self.ssh_key = config['security']['ssh_key_path']
+
+        # SSH连接复用（ControlMaster）：同一目标的多次远程命令共享一条连接
+        # %C 为连接参数的哈希，避免 UNIX socket 路径超长
+        self._control_path = os.path.join(os.path.dirname(self.ssh_key), 'hermit_crab_cm_%C')
+        self._mux_hosts = set()
+        atexit.register(self.close_connections)
+
+        # 迁移进度记录（失败重试时跳过近期已完成的阶段）
+        self._progress_file = os.path.join(config['base']['install_path'], 'data', 'migration_progress.json')
+        self.resume_window = config['migration'].get('resume_window', 3600)
         
         # 检查必要工具
         self._check_dependencies()
@@ -33,11 +48,18 @@ class Migrator:
         """检查并安装必要的依赖"""
         required_tools = ['rsync', 'ssh', 'sshpass', 'tar']
         
-        for tool in required_tools:
-            if not check_command_exists(tool):
-                self.logger.warning(f"{tool} 未安装，尝试安装...")
-                if not install_package(tool):
-                    raise RuntimeError(f"无法安装必要工具: {tool}")
+        # 一次shell调用查询全部工具（输出每个已安装工具的路径；dash 的 command -v 只接受一个参数）
+        _, stdout, _ = run_command(
+            f'for t in {" ".join(required_tools)}; do command -v "$t"; done', timeout=10
+        )
+        found = {os.path.basename(line.strip()) for line in stdout.splitlines()}
+        missing = [tool for tool in required_tools if tool not in found]
+        
+        if missing:
+            # 缺失的工具合并为一次安装
+            self.logger.warning(f"{', '.join(missing)} 未安装，尝试安装...")
+            if not install_packages(missing):
+                raise RuntimeError(f"无法安装必要工具: {', '.join(missing)}")
     
     def test_ssh_connection(self, target_ip: str, password: Optional[str] = None) -> bool:
         """
@@ -57,12 +79,11 @@ class Migrator:
         run_command(f"ssh-keygen -R {target_ip} 2>/dev/null", timeout=10)
 
         if password:
-            escaped_password = shlex.quote(password)
-            cmd = f"sshpass -p {escaped_password} ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 {self.ssh_user}@{target_ip} 'echo SUCCESS'"
+            cmd = f"sshpass -e ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 {self.ssh_user}@{target_ip} 'echo SUCCESS'"
         else:
-            cmd = f"ssh -i {self.ssh_key} -o StrictHostKeyChecking=no -o ConnectTimeout=10 {self.ssh_user}@{target_ip} 'echo SUCCESS'"
+            cmd = f"ssh {self.ssh_opts(target_ip)} -o ConnectTimeout=10 {self.ssh_user}@{target_ip} 'echo SUCCESS'"
         
-        returncode, stdout, stderr = run_command(cmd, timeout=30)
+        returncode, stdout, stderr = run_command(cmd, timeout=30, env={'SSHPASS': password} if password else None)
         
         if returncode == 0 and 'SUCCESS' in stdout:
             self.logger.info("SSH连接测试成功")
@@ -101,9 +122,8 @@ class Migrator:
             self.logger.error(f"公钥文件不存在: {pub_key}")
             return False
 
-        escaped_password = shlex.quote(password)
-        cmd = f"sshpass -p {escaped_password} ssh-copy-id -i {pub_key} -o StrictHostKeyChecking=no {self.ssh_user}@{target_ip}"
-        returncode, stdout, stderr = run_command(cmd, timeout=60)
+        cmd = f"sshpass -e ssh-copy-id -i {pub_key} -o StrictHostKeyChecking=no {self.ssh_user}@{target_ip}"
+        returncode, stdout, stderr = run_command(cmd, timeout=60, env={'SSHPASS': password})
         
         if returncode == 0:
             self.logger.info("SSH密钥配置成功")
@@ -112,6 +132,68 @@ class Migrator:
             self.logger.error(f"SSH密钥配置失败: {stderr}")
             return False
     
+    def _ssh_cipher_opts(self) -> List[str]:
+        """
+        批量传输的SSH加密参数
+
+        压缩已由 rsync/tar 完成，SSH层不再重复压缩
+        """
+        opts = ['-o', 'Compression=no']
+        cipher = self.config['migration'].get('ssh_cipher')
+        if cipher:
+            opts += ['-o', f'Ciphers={cipher}']
+        return opts
+
+    def _ssh_mux_opts(self) -> str:
+        """
+        SSH连接复用参数
+
+        首次连接建立 master，后续命令复用同一TCP连接，省去重复握手和认证
+        """
+        return (
+            f"-o ControlMaster=auto -o ControlPath={self._control_path} "
+            f"-o ControlPersist=60 -o ServerAliveInterval=15 -o ServerAliveCountMax=2"
+        )
+
+    def ssh_opts(self, target_ip: str) -> str:
+        """
+        密钥认证并复用连接的 ssh/scp 参数
+
+        Args:
+            target_ip: 目标服务器IP（登记以便结束时关闭复用连接）
+
+        Returns:
+            参数字符串
+        """
+        self._mux_hosts.add(target_ip)
+        return (
+            f"-i {self.ssh_key} -o StrictHostKeyChecking=no {self._ssh_mux_opts()} "
+            f"{' '.join(self._ssh_cipher_opts())}"
+        )
+
+    def close_connection(self, target_ip: str):
+        """
+        关闭到目标服务器的复用连接
+
+        目标服务器重启前调用，避免后续命令复用已失效的连接
+
+        Args:
+            target_ip: 目标服务器IP
+        """
+        if target_ip not in self._mux_hosts:
+            return
+
+        run_command(
+            f"ssh -o ControlPath={self._control_path} -O exit {self.ssh_user}@{target_ip} 2>/dev/null",
+            timeout=10
+        )
+        self._mux_hosts.discard(target_ip)
+
+    def close_connections(self):
+        """关闭所有复用连接"""
+        for target_ip in list(self._mux_hosts):
+            self.close_connection(target_ip)
+
     def execute_remote_command(self, target_ip: str, command: str, 
                                use_password: bool = False, 
                                password: Optional[str] = None) -> tuple:
@@ -128,12 +210,44 @@ class Migrator:
             (returncode, stdout, stderr)
         """
         if use_password and password:
-            escaped_password = shlex.quote(password)
-            cmd = f"sshpass -p {escaped_password} ssh -o StrictHostKeyChecking=no {self.ssh_user}@{target_ip} '{command}'"
+            # 密码经环境变量传给 sshpass，不出现在进程命令行中
+            cmd = f"sshpass -e ssh -o StrictHostKeyChecking=no {self.ssh_user}@{target_ip} '{command}'"
+            env = {'SSHPASS': password}
         else:
-            cmd = f"ssh -i {self.ssh_key} -o StrictHostKeyChecking=no {self.ssh_user}@{target_ip} '{command}'"
+            # 密钥认证时复用连接（sshpass 与 ControlPersist 后台进程不兼容）
+            cmd = f"ssh {self.ssh_opts(target_ip)} {self.ssh_user}@{target_ip} '{command}'"
+            env = None
         
-        return run_command(cmd, timeout=300)
+        return run_command(cmd, timeout=300, env=env)
+
+    def write_remote_file(self, target_ip: str, remote_path: str, content: bytes) -> tuple:
+        """
+        将内容写入远程文件（经SSH标准输入传输，内容不经过shell解析）
+
+        先写临时文件再改名，读取方不会看到写了一半的文件
+
+        Args:
+            target_ip: 目标服务器IP
+            remote_path: 远程文件路径
+            content: 文件内容
+
+        Returns:
+            (returncode, stdout, stderr)
+        """
+        path = shlex.quote(remote_path)
+        tmp_path = shlex.quote(f"{remote_path}.tmp")
+        cmd = (
+            f"ssh {self.ssh_opts(target_ip)} {self.ssh_user}@{target_ip} "
+            f"{shlex.quote(f'cat > {tmp_path} && mv -f {tmp_path} {path}')}"
+        )
+
+        try:
+            result = subprocess.run(cmd, shell=True, input=content, capture_output=True, timeout=60)
+            return result.returncode, result.stdout.decode(errors='replace'), result.stderr.decode(errors='replace')
+        except subprocess.TimeoutExpired:
+            return -1, "", "Command timeout"
+        except Exception as e:
+            return -1, "", str(e)
     
     def rsync_system_files(self, target_ip: str) -> bool:
         """
@@ -156,7 +270,7 @@ class Migrator:
         # 构建rsync命令
         cmd_parts = [
             'rsync',
-            extra_args,
+            *shlex.split(extra_args),
             f'--exclude-from={exclude_file}'
         ]
         
@@ -164,16 +278,22 @@ class Migrator:
         if bandwidth_limit > 0:
             cmd_parts.append(f'--bwlimit={bandwidth_limit}')
         
-        # 使用SSH密钥
-        cmd_parts.append(f'-e "ssh -i {self.ssh_key} -o StrictHostKeyChecking=no"')
+        # 指定压缩算法/级别（zstd 比默认 zlib 快得多，需要 rsync >= 3.2）
+        compressor = self.config['rsync'].get('compressor')
+        compress_level = self.config['rsync'].get('compress_level', 0)
+        if compressor:
+            cmd_parts.append(f'--compress-choice={compressor}')
+        if compress_level > 0:
+            cmd_parts.append(f'--compress-level={compress_level}')
+        
+        # 使用SSH密钥（复用连接，后续远程命令和最终同步无需重新握手）
+        cmd_parts.extend(['-e', f'ssh {self.ssh_opts(target_ip)}'])
         
         # 源和目标
         cmd_parts.append('/')
         cmd_parts.append(f'{self.ssh_user}@{target_ip}:/')
         
-        cmd = ' '.join(cmd_parts)
-        
-        self.logger.info(f"执行命令: {cmd}")
+        self.logger.info(f"执行命令: {shlex.join(cmd_parts)}")
         
         # 执行rsync
         start_time = time.time()
@@ -184,27 +304,35 @@ class Migrator:
             self.logger.info("-" * 60)
 
             process = subprocess.Popen(
-                cmd,
-                shell=True,
+                cmd_parts,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
+                bufsize=0
             )
 
-            # 实时输出到终端
+            # 实时输出到终端：按块原样转发（不逐行解码/刷新），最多每50毫秒刷新一次
+            out = sys.stdout.buffer
             line_count = 0
-            for line in process.stdout:
-                line = line.strip()
-                if line:
-                    # 直接打印到终端（不经过logger，避免日志文件过大）
-                    print(line, flush=True)
-                    line_count += 1
-
-                    # 每100行记录一次统计到日志
-                    if line_count % 100 == 0:
-                        self.logger.debug(f"已处理 {line_count} 个文件...")
-
+            last_flush = time.monotonic()
+            while True:
+                chunk = os.read(process.stdout.fileno(), 65536)
+                if not chunk:
+                    break
+
+                # 直接写到终端（不经过logger，避免日志文件过大）
+                out.write(chunk)
+                now = time.monotonic()
+                if now - last_flush > 0.05:
+                    out.flush()
+                    last_flush = now
+
+                # 每100行记录一次统计到日志
+                previous = line_count
+                line_count += chunk.count(b'\n')
+                if line_count // 100 > previous // 100:
+                    self.logger.debug(f"已处理 {line_count} 个文件...")
+
+            out.flush()
             process.wait()
 
             elapsed = time.time() - start_time
@@ -237,33 +365,118 @@ class Migrator:
         self.logger.info("开始Tar Stream传输...")
         self.logger.info("=" * 60)
         
+        # 多线程压缩器（pigz/zstd）本地不可用时退回 gzip
+        compressor = self.config['migration'].get('tar_compressor', 'gzip')
+        if compressor not in ('gzip', 'pigz', 'zstd') or not check_command_exists(compressor):
+            compressor = 'gzip'
+        
+        # 按所在设备分组：不同磁盘的目录并行传输，同一磁盘内顺序传输（避免磁头来回寻道）
+        groups = {}
         for directory in directories:
             if not os.path.exists(directory):
                 self.logger.warning(f"目录不存在，跳过: {directory}")
                 continue
-            
-            self.logger.info(f"传输目录: {directory}")
-            
-            # 构建tar stream命令
-            cmd = (
-                f"tar -czf - {directory} | "
-                f"ssh -i {self.ssh_key} -o StrictHostKeyChecking=no "
-                f"{self.ssh_user}@{target_ip} 'cd / && tar -xzf -'"
-            )
-            
-            start_time = time.time()
-            returncode, stdout, stderr = run_command(cmd, timeout=7200)
-            elapsed = time.time() - start_time
-            
-            if returncode == 0:
-                self.logger.info(f"✅ {directory} 传输完成 (耗时: {elapsed:.2f}秒)")
-            else:
-                self.logger.error(f"❌ {directory} 传输失败: {stderr}")
-                return False
+            groups.setdefault(os.stat(directory).st_dev, []).append(directory)
+        
+        if not groups:
+            return True
+        
+        failed = threading.Event()
+        
+        def transfer_group(group: List[str]) -> bool:
+            for directory in group:
+                if failed.is_set():
+                    return False
+                if not self._tar_stream_one(target_ip, directory, compressor):
+                    failed.set()
+                    return False
+            return True
+        
+        concurrency = max(1, self.config['migration'].get('tar_concurrency', 4))
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(groups))) as executor:
+            results = list(executor.map(transfer_group, groups.values()))
+        
+        if not all(results):
+            return False
         
         self.logger.info("Tar Stream传输全部完成")
         return True
     
+    def _tar_stream_one(self, target_ip: str, directory: str, compressor: str = 'gzip') -> bool:
+        """
+        使用Tar Stream传输单个目录
+
+        Args:
+            target_ip: 目标服务器IP
+            directory: 要传输的目录
+            compressor: 压缩器（gzip/pigz/zstd）
+
+        Returns:
+            是否成功
+        """
+        self.logger.info(f"传输目录: {directory}")
+        
+        # 构建tar stream管道（各阶段直接以参数列表启动，不经过shell）
+        # pigz 输出兼容 gzip，目标端无需安装 pigz；zstd 需要目标端也安装 zstd
+        # -b 1024：512KiB 记录（默认 10KiB），减少管道读写次数；解包端 -B 按整记录读取
+        if compressor == 'pigz':
+            stages = [['tar', '-b', '1024', '-cf', '-', directory], ['pigz', '-3']]
+            unpack = "tar -B -xzf -"
+        elif compressor == 'zstd':
+            stages = [['tar', '-b', '1024', '-cf', '-', directory], ['zstd', '-T0', '-3', '-q']]
+            unpack = "zstd -d -q | tar -B -xf -"
+        else:
+            stages = [['tar', '-b', '1024', '-czf', '-', directory]]
+            unpack = "tar -B -xzf -"
+        
+        # 不复用连接：各目录使用独立TCP连接才能并行占满带宽
+        stages.append([
+            'ssh', '-i', self.ssh_key, '-o', 'StrictHostKeyChecking=no', *self._ssh_cipher_opts(),
+            f"{self.ssh_user}@{target_ip}", f"cd / && {unpack}"
+        ])
+        
+        start_time = time.time()
+        processes = []
+        with tempfile.TemporaryFile() as errors:
+            try:
+                stdin = None
+                for argv in stages:
+                    process = subprocess.Popen(argv, stdin=stdin, stdout=subprocess.PIPE, stderr=errors)
+                    if stdin is not None:
+                        # 父进程关闭读端，下游退出时上游能收到 SIGPIPE
+                        stdin.close()
+                    stdin = process.stdout
+                    processes.append(process)
+                
+                processes[-1].communicate(timeout=7200)
+                for process in processes[:-1]:
+                    process.wait(timeout=60)
+                failed = any(process.returncode != 0 for process in processes)
+                
+            except subprocess.TimeoutExpired:
+                failed = True
+                errors.write(b"Command timeout")
+            except Exception as e:
+                failed = True
+                errors.write(str(e).encode())
+            finally:
+                for process in processes:
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+            
+            errors.seek(0)
+            stderr = errors.read().decode(errors='replace')
+        
+        elapsed = time.time() - start_time
+        
+        if not failed:
+            self.logger.info(f"✅ {directory} 传输完成 (耗时: {elapsed:.2f}秒)")
+            return True
+        
+        self.logger.error(f"❌ {directory} 传输失败: {stderr}")
+        return False
+    
     def backup_critical_files(self, target_ip: str) -> bool:
         """
         在目标服务器备份关键文件
@@ -284,10 +497,10 @@ class Migrator:
             "cp -a /etc/hosts /root/backup_before_migration/ 2>/dev/null || true",
         ]
         
-        for cmd in backup_commands:
-            returncode, _, stderr = self.execute_remote_command(target_ip, cmd)
-            if returncode != 0:
-                self.logger.warning(f"备份命令执行警告: {stderr}")
+        # 合并为一次远程调用
+        returncode, _, stderr = self.execute_remote_command(target_ip, "; ".join(backup_commands))
+        if returncode != 0:
+            self.logger.warning(f"备份命令执行警告: {stderr}")
         
         self.logger.info("关键文件备份完成")
         return True
@@ -312,17 +525,19 @@ class Migrator:
             "netplan apply 2>/dev/null || true"
         ]
 
-        for cmd in restore_commands:
-            # 尝试使用SSH密钥
-            returncode, _, stderr = self.execute_remote_command(target_ip, cmd)
+        # 合并为一次远程调用
+        cmd = "; ".join(restore_commands)
 
-            # 如果失败且有密码，尝试使用密码
-            if returncode != 0 and password:
-                self.logger.debug(f"SSH密钥执行失败，尝试使用密码: {cmd}")
-                returncode, _, stderr = self.execute_remote_command(target_ip, cmd, use_password=True, password=password)
+        # 尝试使用SSH密钥
+        returncode, _, stderr = self.execute_remote_command(target_ip, cmd)
 
-            if returncode != 0:
-                self.logger.warning(f"恢复命令执行警告: {stderr}")
+        # 如果失败且有密码，尝试使用密码
+        if returncode != 0 and password:
+            self.logger.debug("SSH密钥执行失败，尝试使用密码")
+            returncode, _, stderr = self.execute_remote_command(target_ip, cmd, use_password=True, password=password)
+
+        if returncode != 0:
+            self.logger.warning(f"恢复命令执行警告: {stderr}")
 
         self.logger.info("网络配置恢复完成")
         return True
@@ -346,10 +561,9 @@ class Migrator:
         run_command(f"ssh-keygen -R {target_ip} 2>/dev/null", timeout=10)
 
         # 使用密码连接并重启 sshd
-        escaped_password = shlex.quote(password)
-        cmd = f"sshpass -p {escaped_password} ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 {self.ssh_user}@{target_ip} 'systemctl restart sshd'"
+        cmd = f"sshpass -e ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 {self.ssh_user}@{target_ip} 'systemctl restart sshd'"
 
-        returncode, stdout, stderr = run_command(cmd, timeout=30)
+        returncode, stdout, stderr = run_command(cmd, timeout=30, env={'SSHPASS': password})
 
         if returncode == 0:
             self.logger.info("✅ sshd 服务重启成功")
@@ -360,6 +574,53 @@ class Migrator:
             self.logger.error(f"sshd 重启失败: {stderr}")
             return False
 
+    def _load_progress(self) -> Dict:
+        """加载迁移进度记录 {target_ip: {phase: 完成时间戳}}"""
+        try:
+            with open(self._progress_file, 'rb') as f:
+                return json_loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"读取迁移进度失败: {e}")
+            return {}
+
+    def _save_progress(self, progress: Dict):
+        """保存迁移进度记录（原子替换）"""
+        try:
+            tmp_file = f"{self._progress_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(json_dumps(progress, indent=True))
+            os.replace(tmp_file, self._progress_file)
+        except Exception as e:
+            self.logger.warning(f"保存迁移进度失败: {e}")
+
+    def _phase_done(self, target_ip: str, phase: str) -> bool:
+        """
+        检查到目标服务器的某个阶段是否在最近完成过
+
+        Args:
+            target_ip: 目标服务器IP
+            phase: 阶段名称
+
+        Returns:
+            是否可以跳过
+        """
+        finished_at = self._load_progress().get(target_ip, {}).get(phase)
+        return finished_at is not None and time.time() - finished_at < self.resume_window
+
+    def _mark_phase(self, target_ip: str, phase: str):
+        """记录阶段完成"""
+        progress = self._load_progress()
+        progress.setdefault(target_ip, {})[phase] = time.time()
+        self._save_progress(progress)
+
+    def _clear_progress(self, target_ip: str):
+        """迁移完成后清除目标服务器的进度记录"""
+        progress = self._load_progress()
+        if progress.pop(target_ip, None) is not None:
+            self._save_progress(progress)
+
     def perform_migration(self, target_ip: str, password: Optional[str] = None) -> bool:
         """
         执行完整迁移流程
@@ -392,11 +653,18 @@ class Migrator:
                     return False
 
             # 3. 备份目标服务器关键文件
-            if not self.backup_critical_files(target_ip):
+            # 重试时不能重新备份：上次rsync可能已用源服务器的文件覆盖了目标的网络配置
+            if self._phase_done(target_ip, 'backup'):
+                self.logger.info("⏩ 最近已备份目标服务器关键文件，跳过")
+            elif self.backup_critical_files(target_ip):
+                self._mark_phase(target_ip, 'backup')
+            else:
                 self.logger.error("备份关键文件失败")
                 return False
 
             # 4. 执行Rsync系统同步
+            # 重试时也重新执行：最终同步只覆盖 data/logs/.env，跳过会丢失之后的系统文件变更；
+            # 最近已完成过全量同步时，本次只传输增量，开销很小
             if not self.rsync_system_files(target_ip):
                 self.logger.error("Rsync系统同步失败")
                 return False
@@ -417,6 +685,8 @@ class Migrator:
                 if not self.tar_stream_transfer(target_ip, tar_dirs):
                     self.logger.warning("Tar Stream传输部分失败，但继续...")
 
+            self._clear_progress(target_ip)
+
             self.logger.info("=" * 60)
             self.logger.info("✅ 迁移完成！")
             self.logger.info("=" * 60)
@@ -450,66 +720,62 @@ class Migrator:
         # 只同步关键的数据和日志目录，避免全盘扫描
         # 注意：lifecycle.json 已在 update_lifecycle_on_target 中正确更新，不要覆盖
         sync_paths = [
-            f"{install_path}/data/",           # nodes.json 等（排除 lifecycle.json）
-            f"{install_path}/logs/",           # 所有日志文件
-            f"{install_path}/.env",            # 配置文件
+            "data/",           # nodes.json 等（排除 lifecycle.json）
+            "logs/",           # 所有日志文件
+            ".env",            # 配置文件
         ]
 
-        success = True
+        # 检查路径是否存在；"/./" 之后的部分作为相对路径在目标端重建（配合 -R）
+        sources = []
         for path in sync_paths:
-            # 检查路径是否存在
-            if not os.path.exists(path):
-                self.logger.debug(f"跳过不存在的路径: {path}")
+            if not os.path.exists(os.path.join(install_path, path)):
+                self.logger.debug(f"跳过不存在的路径: {install_path}/{path}")
                 continue
+            sources.append(f"{install_path}/./{path}")
 
-            # 构建 rsync 命令
-            if os.path.isdir(path):
-                # 目录需要加 /
-                src = path if path.endswith('/') else path + '/'
-                dest = f"{self.ssh_user}@{target_ip}:{path}"
-            else:
-                # 文件
-                src = path
-                dest = f"{self.ssh_user}@{target_ip}:{path}"
-
-            rsync_cmd = [
-                'rsync',
-                '-aAXvz',               # 基本选项
-                '--numeric-ids',        # 保留用户ID
-                '--delete',             # 删除目标中多余的文件
-                '-e', f'ssh -i {self.ssh_key} -o StrictHostKeyChecking=no',
-            ]
+        if not sources:
+            return True
 
+        # 一次rsync同步全部路径（单次协议协商，复用SSH连接）
+        rsync_cmd = [
+            'rsync',
+            '-aAXvzR',              # 基本选项（-R 保留相对路径）
+            '--numeric-ids',        # 保留用户ID
+            '--delete',             # 删除目标中多余的文件
+            '--partial',            # 中断后保留已传输部分，重试时续传
+            '--delay-updates',      # 传输完成后统一替换，避免目标出现半新半旧的文件
             # 排除 lifecycle.json，因为它已在目标服务器上被正确更新
             # 如果再次同步会用源服务器的旧 IP 覆盖目标服务器的正确 IP
-            if path == f"{install_path}/data/":
-                rsync_cmd.append('--exclude=lifecycle.json')
-
-            rsync_cmd.extend([src, dest])
+            '--exclude=/data/lifecycle.json',
+            # 排除邮件重试队列，避免目标服务器重复发送源服务器未发出的邮件
+            '--exclude=/data/notification_queue.jsonl*',
+            '-e', f'ssh {self.ssh_opts(target_ip)}',
+            *sources,
+            f"{self.ssh_user}@{target_ip}:{install_path}/",
+        ]
 
-            self.logger.info(f"同步: {path}")
+        self.logger.info(f"同步: {', '.join(sync_paths)}")
 
-            try:
-                result = subprocess.run(
-                    rsync_cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=300  # 5分钟超时
-                )
-
-                if result.returncode == 0:
-                    self.logger.debug(f"✅ {path} 同步成功")
-                else:
-                    self.logger.warning(f"⚠️  {path} 同步失败: {result.stderr}")
-                    success = False
+        success = True
+        try:
+            result = subprocess.run(
+                rsync_cmd,
+                capture_output=True,
+                text=True,
+                timeout=300  # 5分钟超时
+            )
 
-            except subprocess.TimeoutExpired:
-                self.logger.error(f"❌ {path} 同步超时")
-                success = False
-            except Exception as e:
-                self.logger.error(f"❌ {path} 同步异常: {e}")
+            if result.returncode != 0:
+                self.logger.warning(f"⚠️  同步失败: {result.stderr}")
                 success = False
 
+        except subprocess.TimeoutExpired:
+            self.logger.error("❌ 同步超时")
+            success = False
+        except Exception as e:
+            self.logger.error(f"❌ 同步异常: {e}")
+            success = False
+
         if success:
             self.logger.info("✅ 所有最新数据已同步")
         else:
@@ -4,10 +4,12 @@
 """
 
 import os
-import json
+import copy
+import fcntl
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, Optional
-from .utils import Logger, calculate_days_remaining, format_date, get_current_ip
+from .utils import Logger, format_date, get_current_ip, json_loads, json_dumps
 
 
 class Monitor:
@@ -27,6 +29,14 @@ class Monitor:
         
         # 确保数据目录存在
         os.makedirs(self.data_dir, exist_ok=True)
+        
+        # 生命周期文件解析缓存（按文件修改时间和大小失效）
+        self._cache = None
+        self._cache_stat = None
+        
+        # 过期日期缓存：(added_date, total_days) -> 过期时间
+        self._expire_key = None
+        self._expire = None
     
     def initialize_lifecycle(self) -> Dict:
         """
@@ -53,11 +63,10 @@ class Monitor:
         }
         
         # 保存到文件
-        with open(self.lifecycle_file, 'w', encoding='utf-8') as f:
-            json.dump(lifecycle_info, f, indent=2, ensure_ascii=False)
+        with self._locked():
+            self._save_lifecycle(lifecycle_info)
         
         # 计算过期日期用于日志显示
-        from datetime import timedelta
         added = datetime.strptime(added_date, "%Y-%m-%d")
         expire = added + timedelta(days=total_days)
         
@@ -71,31 +80,98 @@ class Monitor:
         Returns:
             生命周期信息字典，如果不存在则返回None
         """
-        if not os.path.exists(self.lifecycle_file):
+        try:
+            st = os.stat(self.lifecycle_file)
+        except FileNotFoundError:
             self.logger.warning("生命周期文件不存在，需要初始化")
             return None
+        except OSError as e:
+            self.logger.error(f"加载生命周期文件失败: {e}")
+            return None
+        
+        # 文件未变化时直接返回缓存副本（调用方可能修改返回值）
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if self._cache is not None and self._cache_stat == stat_key:
+            return copy.deepcopy(self._cache)
         
         try:
-            with open(self.lifecycle_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.lifecycle_file, 'rb') as f:
+                lifecycle = json_loads(f.read())
         except Exception as e:
             self.logger.error(f"加载生命周期文件失败: {e}")
             return None
+        
+        self._cache = lifecycle
+        self._cache_stat = stat_key
+        return copy.deepcopy(lifecycle)
     
-    def get_remaining_days(self) -> int:
+    @contextmanager
+    def _locked(self):
+        """
+        生命周期文件的排他锁（fcntl 建议锁），保护读-改-写不被其他进程交错
+        
+        读取无需加锁：写入通过原子替换完成，读取方不会读到写了一半的文件
+        """
+        with open(f"{self.lifecycle_file}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _save_lifecycle(self, lifecycle: Dict):
+        """
+        保存生命周期信息（先写临时文件再原子替换，读取方不会读到写了一半的文件）
+        
+        Args:
+            lifecycle: 生命周期信息字典
+        """
+        tmp_file = f"{self.lifecycle_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(json_dumps(lifecycle, indent=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.lifecycle_file)
+        
+        st = os.stat(self.lifecycle_file)
+        self._cache = copy.deepcopy(lifecycle)
+        self._cache_stat = (st.st_mtime_ns, st.st_size)
+    
+    def _expire_date(self, lifecycle: Dict) -> datetime:
+        """
+        计算过期时间（添加日期 + 总天数），相同输入复用上次结果，避免重复解析日期
+        
+        Args:
+            lifecycle: 生命周期信息字典
+            
+        Returns:
+            过期时间
+        """
+        total_days = lifecycle.get('total_days', self.config['lifecycle']['total_days'])
+        key = (lifecycle['added_date'], total_days)
+        if key != self._expire_key:
+            added = datetime.strptime(key[0], "%Y-%m-%d")
+            self._expire = added + timedelta(days=total_days)
+            self._expire_key = key
+        return self._expire
+    
+    def get_remaining_days(self, lifecycle: Optional[Dict] = None) -> int:
         """
         获取剩余天数
         
+        Args:
+            lifecycle: 已加载的生命周期信息（可选，省略时从文件加载）
+        
         Returns:
             剩余天数，如果未初始化返回-1
         """
-        lifecycle = self.load_lifecycle()
+        if lifecycle is None:
+            lifecycle = self.load_lifecycle()
         if lifecycle is None:
             return -1
         
         try:
-            total_days = lifecycle.get('total_days', self.config['lifecycle']['total_days'])
-            return calculate_days_remaining(lifecycle['added_date'], total_days)
+            return (self._expire_date(lifecycle) - datetime.now()).days
         except Exception as e:
             self.logger.error(f"计算剩余天数失败: {e}")
             return -1
@@ -107,8 +183,18 @@ class Monitor:
         Returns:
             是否需要迁移
         """
-        remaining = self.get_remaining_days()
+        return self._should_migrate(self.get_remaining_days())
+    
+    def _should_migrate(self, remaining: int) -> bool:
+        """
+        根据剩余天数判断是否应该迁移
         
+        Args:
+            remaining: 剩余天数
+            
+        Returns:
+            是否需要迁移
+        """
         if remaining < 0:
             self.logger.error("生命周期未初始化或已过期")
             return False
@@ -122,6 +208,28 @@ class Monitor:
             self.logger.info(f"剩余时间 {remaining} 天，暂不需要迁移")
             return False
     
+    def seconds_until_migration(self, lifecycle: Optional[Dict] = None) -> float:
+        """
+        计算距离 _should_migrate 开始返回 True 的秒数
+        
+        剩余天数为 (过期时间 - 当前时间).days（向下取整），remaining < threshold
+        等价于 当前时间 > 过期时间 - threshold 天，因此迁移时刻为 过期时间 - threshold 天
+        
+        Args:
+            lifecycle: 已加载的生命周期信息（可选，省略时从文件加载）
+            
+        Returns:
+            剩余秒数，未初始化或已到迁移时刻时返回0
+        """
+        if lifecycle is None:
+            lifecycle = self.load_lifecycle()
+        if lifecycle is None:
+            return 0
+        
+        threshold = self.config['lifecycle']['migrate_threshold_days']
+        migrate_at = self._expire_date(lifecycle) - timedelta(days=threshold)
+        return max(0, (migrate_at - datetime.now()).total_seconds())
+    
     def update_lifecycle_for_migration(self, target_server: Dict, old_lifecycle: Optional[Dict] = None):
         """
         迁移后更新生命周期信息（保留迁移历史）
@@ -152,8 +260,8 @@ class Monitor:
         }
 
         # 保存到文件
-        with open(self.lifecycle_file, 'w', encoding='utf-8') as f:
-            json.dump(lifecycle_info, f, indent=2, ensure_ascii=False)
+        with self._locked():
+            self._save_lifecycle(lifecycle_info)
 
         self.logger.info(f"生命周期已更新: IP={lifecycle_info['current_ip']}, 保留了 {len(migration_history)} 条迁移历史")
         return lifecycle_info
@@ -165,22 +273,22 @@ class Monitor:
         Args:
             target_server: 目标服务器信息
         """
-        lifecycle = self.load_lifecycle()
-        if lifecycle is None:
-            self.logger.error("无法添加迁移记录：生命周期未初始化")
-            return
+        with self._locked():
+            lifecycle = self.load_lifecycle()
+            if lifecycle is None:
+                self.logger.error("无法添加迁移记录：生命周期未初始化")
+                return
 
-        record = {
-            'timestamp': datetime.now().isoformat(),
-            'target_ip': target_server.get('ip'),
-            'remaining_days': self.get_remaining_days()
-        }
+            record = {
+                'timestamp': datetime.now().isoformat(),
+                'target_ip': target_server.get('ip'),
+                'remaining_days': self.get_remaining_days(lifecycle)
+            }
 
-        lifecycle['migration_history'].append(record)
+            lifecycle['migration_history'].append(record)
 
-        # 保存
-        with open(self.lifecycle_file, 'w', encoding='utf-8') as f:
-            json.dump(lifecycle, f, indent=2, ensure_ascii=False)
+            # 保存
+            self._save_lifecycle(lifecycle)
 
         self.logger.info(f"迁移记录已添加: {target_server.get('ip')}")
     
@@ -201,8 +309,8 @@ class Monitor:
                 'status': 'NOT_INITIALIZED'
             }
         
-        remaining = self.get_remaining_days()
-        should_migrate = self.should_migrate()
+        remaining = self.get_remaining_days(lifecycle)
+        should_migrate = self._should_migrate(remaining)
         
         # 判断状态
         if remaining < 0:
@@ -214,16 +322,10 @@ class Monitor:
         else:
             status = 'HEALTHY'
         
-        # 计算过期日期用于显示
-        from datetime import timedelta
-        added = datetime.strptime(lifecycle['added_date'], "%Y-%m-%d")
-        total_days = lifecycle.get('total_days', self.config['lifecycle']['total_days'])
-        expire = added + timedelta(days=total_days)
-        
         return {
             'initialized': True,
             'added_date': lifecycle['added_date'],
-            'expire_date': format_date(expire),  # 仅用于显示
+            'expire_date': format_date(self._expire_date(lifecycle)),  # 仅用于显示
             'remaining_days': remaining,
             'should_migrate': should_migrate,
             'status': status,
@@ -3,10 +3,112 @@ Hermit Crab 邮件通知模块
 使用 Resend API 发送电子邮件通知
 """
 
-import requests
+import os
+import re
+import fcntl
+import html
+import gzip
+import time
 import logging
-from datetime import datetime
-from typing import Optional, Dict, Any
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Union
+from .utils import json_loads, json_dumps
+
+if TYPE_CHECKING:
+    import requests
+
+
+# ========================================
+# 邮件模板（模块加载时构建一次，发送时只做占位符替换）
+# ========================================
+
+_BASE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="UTF-8"></head>
+<body style="margin:0; padding:20px; font-family:system-ui,-apple-system,sans-serif; background:#f5f5f5;">
+  <div style="max-width:500px; margin:0 auto; background:#fff; border-radius:8px; overflow:hidden; box-shadow:0 1px 3px rgba(0,0,0,0.1);">
+    <div style="background:{status_color}; padding:20px; color:#fff;">
+      <div style="font-size:20px; font-weight:600;">🦀 Hermit Crab</div>
+      <div style="font-size:14px; opacity:0.9; margin-top:4px;">{title}</div>
+    </div>
+    <div style="padding:24px;">
+      {content}
+    </div>
+    <div style="padding:16px 24px; background:#f9f9f9; color:#666; font-size:12px; border-top:1px solid #eee;">
+      {timestamp}
+    </div>
+  </div>
+</body>
+</html>"""
+
+
+def _split_template(template: str, *fields: str) -> tuple:
+    """
+    按占位符顺序把模板切分为静态片段
+
+    Args:
+        template: 模板字符串
+        *fields: 占位符名称（按出现顺序）
+
+    Returns:
+        静态片段元组，长度为 len(fields) + 1
+    """
+    pieces = []
+    rest = template
+    for field in fields:
+        head, _, rest = rest.partition("{%s}" % field)
+        pieces.append(head)
+    pieces.append(rest)
+    return tuple(pieces)
+
+
+# 基础模板的静态片段：发送时只需把动态值与片段拼接，无需重新解析模板
+_BASE_PIECES = _split_template(_BASE_TEMPLATE, "status_color", "title", "content", "timestamp")
+
+_INFO_ROW = '<div style="padding:8px 0; border-bottom:1px solid #eee;"><span style="color:#666;">{}:</span> <strong>{}</strong></div>'.format
+
+_INFO_BLOCK = '<div style="margin:16px 0;">{}</div>'.format
+
+# 行固定的信息表：标签部分预先渲染，发送时只填入值
+_INFO_MIGRATION_STARTED = _INFO_BLOCK(_INFO_ROW("源服务器", "{}") + _INFO_ROW("目标服务器", "{}") + _INFO_ROW("剩余天数", "{} 天")).format
+_INFO_MIGRATION_FAILED = _INFO_BLOCK(_INFO_ROW("源服务器", "{}") + _INFO_ROW("目标服务器", "{}") + _INFO_ROW("失败阶段", "{}")).format
+_INFO_SSH_FAILED = _INFO_BLOCK(_INFO_ROW("服务器", "{}") + _INFO_ROW("重试次数", "{}")).format
+_INFO_NO_SERVERS = _INFO_BLOCK(_INFO_ROW("当前服务器", "{}") + _INFO_ROW("剩余天数", "{}")).format
+
+_ALERT_PIECES = _split_template(
+    '<div style="margin:16px 0; padding:12px; background:{color}10; border-left:3px solid {color}; border-radius:4px; color:#333;">{text}</div>',
+    "color", "color", "text"
+)
+
+# 邮件中用到的状态颜色：与颜色相关的模板头部预先拼好，发送时按颜色查表
+_STATUS_COLORS = ("#3b82f6", "#10b981", "#ef4444", "#f59e0b")
+
+_BASE_HEADS = {c: _BASE_PIECES[0] + c + _BASE_PIECES[1] for c in _STATUS_COLORS}
+
+_ALERT_HEADS = {c: _ALERT_PIECES[0] + c + _ALERT_PIECES[1] + c + _ALERT_PIECES[2] for c in _STATUS_COLORS}
+
+# 生命周期警告级别：(剩余天数上限, 级别, 颜色)，按顺序取第一个满足 remaining_days <= 上限 的级别
+_LIFECYCLE_LEVELS = (
+    (2, "🚨 紧急", "#ef4444"),
+    (5, "⚠️ 警告", "#f59e0b"),
+    (float("inf"), "ℹ️ 提醒", "#3b82f6"),
+)
+
+# 无备用服务器 / 仅1台备用服务器时的提示框内容固定，按 (级别, 可用数量) 预先渲染
+_LIFECYCLE_ALERTS = {}
+for _, _level, _ in _LIFECYCLE_LEVELS:
+    _LIFECYCLE_ALERTS[_level, 0] = _ALERT_HEADS["#ef4444"] + f"{_level}: ❌ 无可用服务器！请立即添加新服务器" + _ALERT_PIECES[3]
+    _LIFECYCLE_ALERTS[_level, 1] = _ALERT_HEADS["#f59e0b"] + f"{_level}: ⚠️ 仅1台备用服务器，建议增加更多" + _ALERT_PIECES[3]
+del _level
+
+
+@lru_cache(maxsize=4)
+def _fmt_ts(sec: int) -> str:
+    """按秒缓存格式化后的时间戳，同一秒内的多封邮件只格式化一次"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
 
 
 class ResendNotifier:
@@ -28,9 +130,21 @@ class ResendNotifier:
         self.from_email = config.get('notification', {}).get('from_email', '')
         self.to_emails = config.get('notification', {}).get('to_emails', [])
 
+        # 日志脱敏：服务端错误信息可能回显 API Key
+        self._redact = re.compile(re.escape(self.api_key)).sub if self.api_key else (lambda _repl, text: text)
+
         # Resend API endpoint
         self.api_url = "https://api.resend.com/emails"
 
+        # 批量模式下暂存的邮件（None 表示逐封立即发送）
+        self._batch = None
+
+        # 后台发送线程（首次发送时创建；单线程保证邮件按顺序发出）
+        self._executor = None
+
+        # 超过 1KB 的请求体使用 gzip 压缩（服务端返回 415 时自动关闭）
+        self._gzip = True
+
         if self.enabled and not self.api_key:
             self.logger.warning("邮件通知已启用但未配置 API Key")
             self.enabled = False
@@ -39,94 +153,357 @@ class ResendNotifier:
             self.logger.warning("邮件通知已启用但未配置收件人")
             self.enabled = False
 
+        # 发送失败的邮件重试队列（持久化到文件；任何进程都可入队，只有守护进程负责重新发送）
+        self._retry_thread = None
+        self._retry_stop = threading.Event()
+        install_path = config.get('base', {}).get('install_path')
+        self._retry_file = os.path.join(install_path, 'data', 'notification_queue.jsonl') if install_path else None
+
+    @cached_property
+    def session(self) -> "requests.Session":
+        """
+        复用连接的会话（首次发送时创建；通知未启用时不加载 requests）
+
+        默认仅对幂等请求按状态码重试，POST 只在连接建立失败时重试，不会重复发信
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+        session.mount("https://", HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=4,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        ))
+        return session
+
     def is_available(self) -> bool:
         """检查通知功能是否可用"""
         return self.enabled and bool(self.api_key) and bool(self.to_emails)
 
-    def send_email(self, subject: str, html_content: str, to_emails: Optional[list] = None) -> bool:
+    def send_email(self, subject: str, html_content: Union[str, Callable[[], str]], to_emails: Optional[list] = None,
+                   wait: bool = False) -> bool:
         """
         发送邮件
 
+        默认在后台线程发送，调用方不等待 HTTP 请求完成
+
         Args:
             subject: 邮件主题
-            html_content: HTML 内容
+            html_content: HTML 内容，或生成 HTML 的函数（通知可用时才调用）
             to_emails: 收件人列表（可选，默认使用配置中的）
+            wait: 是否同步等待发送结果
 
         Returns:
-            是否发送成功
+            是否发送成功（异步发送时表示已提交）
         """
         if not self.is_available():
             self.logger.debug("邮件通知未启用，跳过发送")
             return False
 
         recipients = to_emails or self.to_emails
+        if callable(html_content):
+            html_content = html_content()
+
+        payload = {
+            "from": self.from_email,
+            "to": recipients,
+            "subject": subject,
+            "html": html_content
+        }
+
+        # 批量模式：暂存，退出 notify_batch() 时统一发送
+        if self._batch is not None:
+            self._batch.append(payload)
+            return True
+
+        if wait:
+            return self._send_email_sync(payload)
+
+        self._submit(self._send_email_sync, payload)
+        return True
+
+    def _submit(self, fn: Callable, *args):
+        """提交到后台发送线程（首次使用时创建，close() 时等待完成）"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="resend")
+        self._executor.submit(fn, *args)
+
+    def _send_email_sync(self, payload: Dict[str, Any], attempts: int = 0) -> bool:
+        """
+        同步发送一封邮件（临时性失败时加入重试队列）
+
+        Args:
+            payload: 邮件请求体
+            attempts: 已重试次数
 
+        Returns:
+            是否发送成功
+        """
+        subject = payload["subject"]
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-
-            payload = {
-                "from": self.from_email,
-                "to": recipients,
-                "subject": subject,
-                "html": html_content
-            }
-
-            self.logger.debug(f"发送邮件: {subject} -> {recipients}")
-
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            self.logger.debug("发送邮件: %s -> %s", subject, payload['to'])
+
+            response = self._post(self.api_url, payload)
 
             if response.status_code == 200:
-                self.logger.info(f"✅ 邮件发送成功: {subject}")
+                self.logger.info("✅ 邮件发送成功: %s", subject)
                 return True
-            else:
-                self.logger.error(f"❌ 邮件发送失败: {response.status_code} - {response.text}")
-                return False
+
+            self.logger.error("❌ 邮件发送失败: %s - %s", response.status_code, self._redact('[REDACTED]', response.text))
+            # 限流和服务端错误稍后重试；其他 4xx（如参数错误）重试也不会成功
+            if response.status_code == 429 or response.status_code >= 500:
+                self._schedule_retry(payload, attempts)
+            return False
 
         except Exception as e:
-            self.logger.error(f"发送邮件异常: {e}")
+            self.logger.error("发送邮件异常: %s", e)
+            self._schedule_retry(payload, attempts)
             return False
 
+    def _post(self, url: str, obj: Any) -> "requests.Response":
+        """
+        POST JSON 请求体，较大的请求体使用 gzip 压缩
+
+        Args:
+            url: 请求地址
+            obj: 请求体对象
+
+        Returns:
+            响应对象
+        """
+        body = json_dumps(obj)
+        if self._gzip and len(body) > 1024:
+            response = self.session.post(
+                url,
+                data=gzip.compress(body, compresslevel=1),
+                headers={"Content-Encoding": "gzip"},
+                timeout=30
+            )
+            if response.status_code != 415:
+                return response
+            self.logger.warning("Resend 不接受 gzip 请求体，改为不压缩发送")
+            self._gzip = False
+        return self.session.post(url, data=body, timeout=30)
+
+    # ========================================
+    # 失败重试
+    # ========================================
+
+    _RETRY_MAX_ATTEMPTS = 6
+    _RETRY_MAX_QUEUED = 1000
+    _RETRY_BASE = 30
+    _RETRY_CAP = 3600
+
+    def _schedule_retry(self, payload: Dict[str, Any], attempts: int):
+        """
+        将发送失败的邮件加入重试队列文件（指数退避）
+
+        Args:
+            payload: 邮件请求体
+            attempts: 已重试次数
+        """
+        if attempts >= self._RETRY_MAX_ATTEMPTS:
+            self.logger.error("❌ 邮件重试 %d 次仍失败，放弃: %s", attempts, payload['subject'])
+            return
+
+        if not self._retry_file:
+            return
+
+        delay = min(self._RETRY_CAP, self._RETRY_BASE * 2 ** attempts)
+        try:
+            with self._retry_locked():
+                entries = self._read_retry_queue()
+                entries.append({
+                    "payload": payload,
+                    "attempts": attempts,
+                    "next_try": time.time() + delay
+                })
+                self._write_retry_queue(entries[-self._RETRY_MAX_QUEUED:])
+        except Exception as e:
+            self.logger.warning("保存邮件重试队列失败: %s", e)
+            return
+        self.logger.info("邮件将在 %s 秒后重试: %s", delay, payload['subject'])
+
+    def serve_retry_queue(self):
+        """
+        由本进程负责重新发送重试队列中的邮件（仅守护进程调用）
+
+        定时任务等短进程只向队列文件追加，不读取重发，同一封邮件不会被多个进程重复发送
+        """
+        if not self.enabled or not self._retry_file:
+            return
+        if self._retry_thread is None or not self._retry_thread.is_alive():
+            self._retry_stop.clear()
+            self._retry_thread = threading.Thread(target=self._retry_loop, name="resend-retry", daemon=True)
+            self._retry_thread.start()
+
+    def _retry_loop(self):
+        """每5秒检查一次重试队列文件，取出到期的邮件重新发送，直到 close()"""
+        while not self._retry_stop.wait(5):
+            if not os.path.exists(self._retry_file):
+                continue
+
+            now = time.time()
+            try:
+                with self._retry_locked():
+                    entries = self._read_retry_queue()
+                    due = [entry for entry in entries if entry["next_try"] <= now]
+                    if due:
+                        self._write_retry_queue([entry for entry in entries if entry["next_try"] > now])
+            except Exception as e:
+                self.logger.warning("读取邮件重试队列失败: %s", e)
+                continue
+
+            for i, entry in enumerate(due):
+                if self._retry_stop.is_set():
+                    # 已停止：未发送的邮件放回队列文件，由下次启动的守护进程继续发送
+                    self._requeue(due[i:])
+                    return
+                # 失败时由 _send_email_sync 重新入队
+                self._send_email_sync(entry["payload"], entry["attempts"] + 1)
+
+    def _requeue(self, entries: list):
+        """
+        将取出但未发送的邮件原样放回重试队列文件
+
+        Args:
+            entries: 重试队列条目
+        """
+        try:
+            with self._retry_locked():
+                queued = self._read_retry_queue()
+                self._write_retry_queue((entries + queued)[-self._RETRY_MAX_QUEUED:])
+        except Exception as e:
+            self.logger.warning("保存邮件重试队列失败: %s", e)
+
+    @contextmanager
+    def _retry_locked(self):
+        """
+        重试队列文件的排他锁（fcntl 建议锁），保护多个进程/线程对队列文件的读-改-写
+        """
+        with open(f"{self._retry_file}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_retry_queue(self) -> list:
+        """读取重试队列文件（调用方需持有 _retry_locked）"""
+        try:
+            with open(self._retry_file, 'rb') as f:
+                return [json_loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _write_retry_queue(self, entries: list):
+        """写入重试队列文件，队列为空时删除文件（调用方需持有 _retry_locked）"""
+        if not entries:
+            try:
+                os.remove(self._retry_file)
+            except FileNotFoundError:
+                pass
+            return
+
+        tmp_file = f"{self._retry_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            for entry in entries:
+                f.write(json_dumps(entry) + b"\n")
+        os.replace(tmp_file, self._retry_file)
+
+    def close(self):
+        """停止重试线程，并等待后台待发送的邮件发送完成"""
+        self._retry_stop.set()
+        if self._retry_thread is not None:
+            # 等待正在发送的一封完成，其余未发送的由重试线程放回队列文件
+            self._retry_thread.join()
+            self._retry_thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    @contextmanager
+    def notify_batch(self):
+        """
+        批量发送上下文：期间的通知暂存，退出时通过批量接口一次发送
+
+        用法:
+            with notifier.notify_batch():
+                notifier.notify_xxx(...)
+                notifier.notify_yyy(...)
+        """
+        if self._batch is not None:
+            # 已在批量模式中，由外层统一发送
+            yield
+            return
+
+        self._batch = []
+        try:
+            yield
+        finally:
+            pending, self._batch = self._batch, None
+            if pending:
+                # 与逐封发送一样在后台线程发送，close() 时等待完成
+                self._submit(self.flush, pending)
+
+    def flush(self, payloads: list) -> bool:
+        """
+        通过 Resend 批量接口发送多封邮件（每次请求最多100封）
+
+        某批临时性失败（限流、服务端错误、网络异常）时，该批每封邮件分别加入重试队列
+
+        Args:
+            payloads: 邮件请求体列表
+
+        Returns:
+            是否全部发送成功
+        """
+        success = True
+        for start in range(0, len(payloads), 100):
+            chunk = payloads[start:start + 100]
+            try:
+                response = self._post(f"{self.api_url}/batch", chunk)
+                if response.status_code == 200:
+                    self.logger.info("✅ 批量邮件发送成功: %d 封", len(chunk))
+                    continue
+                self.logger.error("❌ 批量邮件发送失败: %s - %s", response.status_code, self._redact('[REDACTED]', response.text))
+                retry = response.status_code == 429 or response.status_code >= 500
+            except Exception as e:
+                self.logger.error("批量发送邮件异常: %s", e)
+                retry = True
+
+            success = False
+            if retry:
+                for payload in chunk:
+                    self._schedule_retry(payload, 0)
+        return success
+
     # ========================================
     # 邮件模板
     # ========================================
 
     def _get_base_template(self, title: str, content: str, status_color: str = "#3b82f6") -> str:
         """基础邮件模板"""
-        return f"""<!DOCTYPE html>
-<html>
-<head><meta charset="UTF-8"></head>
-<body style="margin:0; padding:20px; font-family:system-ui,-apple-system,sans-serif; background:#f5f5f5;">
-  <div style="max-width:500px; margin:0 auto; background:#fff; border-radius:8px; overflow:hidden; box-shadow:0 1px 3px rgba(0,0,0,0.1);">
-    <div style="background:{status_color}; padding:20px; color:#fff;">
-      <div style="font-size:20px; font-weight:600;">🦀 Hermit Crab</div>
-      <div style="font-size:14px; opacity:0.9; margin-top:4px;">{title}</div>
-    </div>
-    <div style="padding:24px;">
-      {content}
-    </div>
-    <div style="padding:16px 24px; background:#f9f9f9; color:#666; font-size:12px; border-top:1px solid #eee;">
-      {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-    </div>
-  </div>
-</body>
-</html>"""
+        p = _BASE_PIECES
+        head = _BASE_HEADS.get(status_color) or p[0] + status_color + p[1]
+        timestamp = _fmt_ts(int(time.time()))
+        return "".join((head, title, p[2], content, p[3], timestamp, p[4]))
 
     def _format_info(self, data: Dict[str, str]) -> str:
         """格式化信息列表"""
-        items = "".join(f'<div style="padding:8px 0; border-bottom:1px solid #eee;"><span style="color:#666;">{k}:</span> <strong>{v}</strong></div>' for k, v in data.items())
-        return f'<div style="margin:16px 0;">{items}</div>'
+        return _INFO_BLOCK("".join(_INFO_ROW(k, html.escape(str(v))) for k, v in data.items()))
 
     def _alert_box(self, text: str, color: str = "#3b82f6") -> str:
         """提示框"""
-        return f'<div style="margin:16px 0; padding:12px; background:{color}10; border-left:3px solid {color}; border-radius:4px; color:#333;">{text}</div>'
+        p = _ALERT_PIECES
+        head = _ALERT_HEADS.get(color) or p[0] + color + p[1] + color + p[2]
+        return "".join((head, text, p[3]))
 
     # ========================================
     # 通知方法
@@ -134,13 +511,15 @@ class ResendNotifier:
 
     def notify_migration_started(self, source_ip: str, target_ip: str, remaining_days: int) -> bool:
         """迁移开始通知"""
-        info = {"源服务器": source_ip, "目标服务器": target_ip, "剩余天数": f"{remaining_days} 天"}
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">检测到服务器即将到期，正在自动执行迁移。</p>
-        {self._format_info(info)}
-        {self._alert_box("💡 迁移过程可能需要几分钟到几小时")}
-        """
-        return self.send_email(f"🔄 迁移开始 - {source_ip} → {target_ip}", self._get_base_template("迁移开始", content, "#3b82f6"))
+        def render() -> str:
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">检测到服务器即将到期，正在自动执行迁移。</p>
+            {_INFO_MIGRATION_STARTED(source_ip, target_ip, remaining_days)}
+            {self._alert_box("💡 迁移过程可能需要几分钟到几小时")}
+            """
+            return self._get_base_template("迁移开始", content, "#3b82f6")
+
+        return self.send_email(f"🔄 迁移开始 - {source_ip} → {target_ip}", render)
 
     def notify_migration_success(self, source_ip: str, target_ip: str,
                                 duration_seconds: float, domain: Optional[str] = None) -> bool:
@@ -148,23 +527,29 @@ class ResendNotifier:
         info = {"源服务器": source_ip, "目标服务器": target_ip, "耗时": f"{duration_seconds / 60:.1f} 分钟"}
         if domain:
             info["域名"] = domain
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">服务器迁移已成功完成！</p>
-        {self._format_info(info)}
-        {self._alert_box("✅ DNS 已更新，服务正常运行", "#10b981")}
-        """
-        return self.send_email(f"✅ 迁移成功 - {source_ip} → {target_ip}", self._get_base_template("迁移成功", content, "#10b981"))
+
+        def render() -> str:
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">服务器迁移已成功完成！</p>
+            {self._format_info(info)}
+            {self._alert_box("✅ DNS 已更新，服务正常运行", "#10b981")}
+            """
+            return self._get_base_template("迁移成功", content, "#10b981")
+
+        return self.send_email(f"✅ 迁移成功 - {source_ip} → {target_ip}", render)
 
     def notify_migration_failed(self, source_ip: str, target_ip: Optional[str],
                                error_message: str, stage: str = "未知") -> bool:
         """迁移失败通知"""
-        info = {"源服务器": source_ip, "目标服务器": target_ip or "未选择", "失败阶段": stage}
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">迁移过程中遇到错误，需要人工处理。</p>
-        {self._format_info(info)}
-        {self._alert_box(f"❌ {error_message}", "#ef4444")}
-        """
-        return self.send_email(f"❌ 迁移失败 - {source_ip}", self._get_base_template("迁移失败", content, "#ef4444"))
+        def render() -> str:
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">迁移过程中遇到错误，需要人工处理。</p>
+            {_INFO_MIGRATION_FAILED(source_ip, target_ip or "未选择", html.escape(stage))}
+            {self._alert_box(f"❌ {html.escape(error_message)}", "#ef4444")}
+            """
+            return self._get_base_template("迁移失败", content, "#ef4444")
+
+        return self.send_email(f"❌ 迁移失败 - {source_ip}", render)
 
     def notify_lifecycle_warning(self, server_ip: str, remaining_days: int,
                                 total_days: int, domain: Optional[str] = None,
@@ -175,30 +560,21 @@ class ResendNotifier:
             info["域名"] = domain
         info["可用备用服务器"] = f"{available_servers_count} 台"
 
-        if remaining_days <= 2:
-            level, color = "🚨 紧急", "#ef4444"
-        elif remaining_days <= 5:
-            level, color = "⚠️ 警告", "#f59e0b"
-        else:
-            level, color = "ℹ️ 提醒", "#3b82f6"
-
-        # 根据可用服务器数量生成提示
-        if available_servers_count == 0:
-            alert_msg = f"{level}: ❌ 无可用服务器！请立即添加新服务器"
-            alert_color = "#ef4444"  # 红色
-        elif available_servers_count == 1:
-            alert_msg = f"{level}: ⚠️ 仅1台备用服务器，建议增加更多"
-            alert_color = "#f59e0b"  # 橙色
-        else:
-            alert_msg = f"{level}: ✅ 有 {available_servers_count} 台备用服务器可用"
-            alert_color = color
-
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">服务器生命周期即将结束。</p>
-        {self._format_info(info)}
-        {self._alert_box(alert_msg, alert_color)}
-        """
-        return self.send_email(f"{level} 剩余 {remaining_days} 天 - {server_ip}", self._get_base_template("生命周期警告", content, color))
+        _, level, color = next(entry for entry in _LIFECYCLE_LEVELS if remaining_days <= entry[0])
+
+        def render() -> str:
+            # 根据可用服务器数量生成提示（0台为红色、1台为橙色，内容固定；多台时与级别同色）
+            alert_html = _LIFECYCLE_ALERTS.get((level, available_servers_count))
+            if alert_html is None:
+                alert_html = self._alert_box(f"{level}: ✅ 有 {available_servers_count} 台备用服务器可用", color)
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">服务器生命周期即将结束。</p>
+            {self._format_info(info)}
+            {alert_html}
+            """
+            return self._get_base_template("生命周期警告", content, color)
+
+        return self.send_email(f"{level} 剩余 {remaining_days} 天 - {server_ip}", render)
 
     def notify_server_added(self, server_ip: str, added_by: str = "系统",
                            notes: str = "", expire_date: Optional[str] = None) -> bool:
@@ -208,28 +584,36 @@ class ResendNotifier:
             info["备注"] = notes
         if expire_date:
             info["过期时间"] = expire_date
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">新服务器已添加到服务器池。</p>
-        {self._format_info(info)}
-        """
-        return self.send_email(f"🆕 新服务器 - {server_ip}", self._get_base_template("服务器添加", content, "#10b981"))
+
+        def render() -> str:
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">新服务器已添加到服务器池。</p>
+            {self._format_info(info)}
+            """
+            return self._get_base_template("服务器添加", content, "#10b981")
+
+        return self.send_email(f"🆕 新服务器 - {server_ip}", render)
 
     def notify_ssh_failed(self, server_ip: str, error_message: str, retry_count: int = 0) -> bool:
         """SSH 连接失败通知"""
-        info = {"服务器": server_ip, "重试次数": str(retry_count)}
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">连接目标服务器失败。</p>
-        {self._format_info(info)}
-        {self._alert_box(f"❌ {error_message}", "#ef4444")}
-        """
-        return self.send_email(f"❌ SSH 失败 - {server_ip}", self._get_base_template("SSH 失败", content, "#ef4444"))
+        def render() -> str:
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">连接目标服务器失败。</p>
+            {_INFO_SSH_FAILED(server_ip, retry_count)}
+            {self._alert_box(f"❌ {html.escape(error_message)}", "#ef4444")}
+            """
+            return self._get_base_template("SSH 失败", content, "#ef4444")
+
+        return self.send_email(f"❌ SSH 失败 - {server_ip}", render)
 
     def notify_no_available_servers(self, current_ip: str, remaining_days: int) -> bool:
         """无可用服务器通知"""
-        info = {"当前服务器": current_ip, "剩余天数": str(remaining_days)}
-        content = f"""
-        <p style="color:#333; margin:0 0 16px;">需要迁移但找不到可用的目标服务器。</p>
-        {self._format_info(info)}
-        {self._alert_box("🚨 请尽快添加新服务器到服务器池", "#ef4444")}
-        """
-        return self.send_email(f"🚨 无可用服务器 - 剩余 {remaining_days} 天", self._get_base_template("无可用服务器", content, "#ef4444"))
+        def render() -> str:
+            content = f"""
+            <p style="color:#333; margin:0 0 16px;">需要迁移但找不到可用的目标服务器。</p>
+            {_INFO_NO_SERVERS(current_ip, remaining_days)}
+            {self._alert_box("🚨 请尽快添加新服务器到服务器池", "#ef4444")}
+            """
+            return self._get_base_template("无可用服务器", content, "#ef4444")
+
+        return self.send_email(f"🚨 无可用服务器 - 剩余 {remaining_days} 天", render)
@@ -3,11 +3,56 @@
 负责管理和选择可用服务器
 """
 
-import json
 import os
-from datetime import datetime
+import copy
+import hashlib
+from contextlib import contextmanager
+from datetime import date
+from functools import lru_cache
 from typing import Dict, List, Optional
-from .utils import Logger, calculate_days_remaining
+from .utils import Logger, calculate_days_remaining, format_datetime, get_current_ip, json_loads, json_dumps
+
+
+# 不限制只选 idle 时，明确不能作为迁移目标的状态
+_UNAVAILABLE_STATUSES = frozenset(('transferring', 'dead', 'active'))
+
+
+@lru_cache(maxsize=4096)
+def _days_remaining(added_date: str, total_days: int, today: int) -> Optional[int]:
+    """
+    按 (添加日期, 生命周期, 当天) 缓存剩余天数，跨天后自动失效
+
+    Args:
+        added_date: 添加日期字符串 (YYYY-MM-DD)
+        total_days: 服务器总生命周期（天）
+        today: 当天日期序号（date.toordinal()，仅作为缓存键）
+
+    Returns:
+        剩余天数，日期格式错误返回None（错误结果同样缓存，不会反复解析）
+    """
+    try:
+        return calculate_days_remaining(added_date, total_days)
+    except ValueError:
+        return None
+
+
+def _server_days_remaining(server: Dict, default_total_days: int, today: int) -> Optional[int]:
+    """
+    计算服务器剩余天数（先校验字段类型，循环中无需 try/except）
+
+    Args:
+        server: 服务器信息
+        default_total_days: 服务器未设置 total_days 时使用的默认值
+        today: 当天日期序号
+
+    Returns:
+        剩余天数，字段缺失或格式错误返回None
+    """
+    added_date = server.get('added_date')
+    total_days = server.get('total_days', default_total_days)
+    if not isinstance(added_date, str) or not isinstance(total_days, int):
+        return None
+    return _days_remaining(added_date, total_days, today)
 
 
 class Scanner:
@@ -24,6 +69,17 @@ class Scanner:
         self.logger = Logger().get_logger()
         self.nodes_file = config['github']['local_cache']
         
+        # 最近一次写入内容的摘要（不含时间戳）及写入后的文件状态，内容未变化时跳过写入
+        self._last_digest = None
+        self._last_stat = None
+        
+        # 已解析的服务器列表缓存（按文件 (修改时间, 大小) 失效）
+        self._cache = None
+        self._cache_stat = None
+        
+        # buffered() 期间暂存的服务器列表（None 表示每次保存都立即写盘）
+        self._pending = None
+        
         # 确保数据目录存在
         os.makedirs(os.path.dirname(self.nodes_file), exist_ok=True)
     
@@ -34,91 +90,205 @@ class Scanner:
         Returns:
             服务器列表字典
         """
-        if not os.path.exists(self.nodes_file):
+        # 缓冲模式下直接返回暂存的列表，多次修改累积到同一份数据上
+        if self._pending is not None:
+            return self._pending
+        
+        stat = self._file_stat()
+        if stat is None:
             self.logger.warning(f"服务器列表文件不存在: {self.nodes_file}")
             return {'servers': []}
         
+        # 文件未变化时直接返回缓存副本（调用方可能修改返回值）
+        if self._cache is not None and self._cache_stat == stat:
+            return copy.deepcopy(self._cache)
+        
         try:
-            with open(self.nodes_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.nodes_file, 'rb') as f:
+                nodes_data = json_loads(f.read())
         except Exception as e:
             self.logger.error(f"加载服务器列表失败: {e}")
             return {'servers': []}
+        
+        self._cache = nodes_data
+        self._cache_stat = stat
+        return copy.deepcopy(nodes_data)
+    
+    @contextmanager
+    def buffered(self):
+        """
+        缓冲上下文：期间的读写都作用于内存中的同一份列表，退出时只保存一次
+        
+        用法:
+            with scanner.buffered():
+                scanner.update_server_status(ip1, 'active')
+                scanner.remove_server(ip2)
+        """
+        if self._pending is not None:
+            # 嵌套调用时由最外层统一保存
+            yield
+            return
+        
+        self._pending = self.load_nodes()
+        try:
+            yield
+            nodes_data = self._pending
+        finally:
+            self._pending = None
+        self.save_nodes(nodes_data)
     
-    def save_nodes(self, nodes_data: Dict):
+    @staticmethod
+    def index_by_ip(nodes_data: Dict) -> Dict[str, Dict]:
+        """
+        按IP建立服务器索引
+
+        Args:
+            nodes_data: 服务器列表字典
+
+        Returns:
+            {ip: server} 字典（值与 nodes_data 中的服务器为同一对象）
+        """
+        return {server.get('ip'): server for server in nodes_data.get('servers', [])}
+
+    @classmethod
+    def remove_server_inplace(cls, ip: str, nodes_data: Dict,
+                              servers_by_ip: Optional[Dict[str, Dict]] = None) -> bool:
+        """
+        从服务器列表字典中直接删除服务器（不读写文件）
+
+        Args:
+            ip: 服务器IP地址
+            nodes_data: 服务器列表字典
+            servers_by_ip: 已建立的IP索引（可选，不传则现建）
+
+        Returns:
+            是否删除了服务器
+        """
+        if servers_by_ip is None:
+            servers_by_ip = cls.index_by_ip(nodes_data)
+
+        server = servers_by_ip.pop(ip, None)
+        if server is None:
+            return False
+
+        # 按对象身份定位后原地删除，保持其余服务器顺序，无需重建整个列表
+        servers = nodes_data['servers']
+        for pos, candidate in enumerate(servers):
+            if candidate is server:
+                del servers[pos]
+                break
+        return True
+
+    def _file_stat(self) -> Optional[tuple]:
+        """服务器列表文件的 (修改时间, 大小)，文件不存在返回None"""
+        try:
+            st = os.stat(self.nodes_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def save_nodes(self, nodes_data: Dict, pretty: bool = False):
         """
         保存服务器列表
         
+        本地缓存只供程序读取，默认写紧凑格式；需要人工查看时传 pretty=True
+        
         Args:
             nodes_data: 服务器列表字典
+            pretty: 是否缩进格式化输出
         """
+        if self._pending is not None:
+            self._pending = nodes_data
+            return
+        
         try:
+            # 内容未变化则跳过写入
+            content = {k: v for k, v in nodes_data.items() if k != 'last_updated'}
+            digest = hashlib.blake2b(json_dumps(content, sort_keys=True)).digest()
+            if digest == self._last_digest and self._file_stat() == self._last_stat:
+                self.logger.debug("服务器列表未变化，跳过保存")
+                return
+            
             # 更新时间戳
-            nodes_data['last_updated'] = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+            nodes_data['last_updated'] = format_datetime()
             
-            with open(self.nodes_file, 'w', encoding='utf-8') as f:
-                json.dump(nodes_data, f, indent=2, ensure_ascii=False)
+            # 先写临时文件再原子替换，避免写入中断导致文件损坏
+            data = json_dumps(nodes_data, indent=pretty)
+            tmp_file = f"{self.nodes_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.nodes_file)
+            self._last_digest = digest
+            self._last_stat = self._file_stat()
+            self._cache = copy.deepcopy(nodes_data)
+            self._cache_stat = self._last_stat
             
             self.logger.info("服务器列表已保存")
         except Exception as e:
             self.logger.error(f"保存服务器列表失败: {e}")
     
-    def get_available_servers(self, only_idle: bool = True, exclude_current: bool = True) -> List[Dict]:
+    def get_available_servers(self, only_idle: bool = True, exclude_current: bool = True,
+                              current_ip: Optional[str] = None,
+                              nodes_data: Optional[Dict] = None) -> List[Dict]:
         """
         获取可用服务器列表
 
         Args:
             only_idle: 是否只筛选idle状态的服务器（默认True，更合理）
             exclude_current: 是否排除当前服务器（默认True）
+            current_ip: 当前服务器IP（调用方已知时传入，避免再次联网探测）
+            nodes_data: 已加载的服务器列表（可选，不传则从本地文件读取）
 
         Returns:
             可用服务器列表
         """
-        nodes_data = self.load_nodes()
+        if nodes_data is None:
+            nodes_data = self.load_nodes()
         servers = nodes_data.get('servers', [])
 
         # 获取当前服务器IP
-        from .utils import get_current_ip
-        current_ip = get_current_ip() if exclude_current else None
+        if exclude_current and current_ip is None:
+            current_ip = get_current_ip()
+
+        # 循环内用到的值提前取出，避免每台服务器重复查找
+        default_total_days = self.config['lifecycle']['total_days']
+        today = date.today().toordinal()
+        debug = self.logger.debug
 
         available = []
         for server in servers:
+            ip = server.get('ip')
+
             # 排除当前服务器
-            if exclude_current and server.get('ip') == current_ip:
-                self.logger.debug(f"排除当前服务器: {current_ip}")
+            if exclude_current and ip == current_ip:
+                debug(f"排除当前服务器: {current_ip}")
                 continue
 
-            # 筛选idle状态（更合理的做法）
+            # 筛选idle状态（更合理的做法）；不限制只idle时，排除明确不可用的状态
             server_status = server.get('status', 'idle')
-            if only_idle:
-                if server_status != 'idle':
-                    self.logger.debug(f"跳过非idle服务器: {server['ip']} (状态: {server_status})")
-                    continue
-            else:
-                # 如果不限制只idle，则排除明确不可用的状态
-                if server_status in ['transferring', 'dead', 'active']:
-                    self.logger.debug(f"跳过不可用服务器: {server['ip']} (状态: {server_status})")
-                    continue
-
-            # 检查是否过期
-            try:
-                # 优先使用服务器自己的 total_days，否则使用默认配置
-                total_days = server.get('total_days', self.config['lifecycle']['total_days'])
-                remaining = calculate_days_remaining(server['added_date'], total_days)
-                if remaining < 0:
-                    self.logger.warning(f"服务器 {server['ip']} 已过期")
-                    continue
-
-                # 添加剩余天数信息
-                server['remaining_days'] = remaining
-                available.append(server)
-            except Exception as e:
-                self.logger.error(f"处理服务器 {server.get('ip')} 时出错: {e}")
+            if (server_status != 'idle') if only_idle else (server_status in _UNAVAILABLE_STATUSES):
+                debug(f"跳过不可用服务器: {ip} (状态: {server_status})")
+                continue
+
+            # 检查是否过期（优先使用服务器自己的 total_days，否则使用默认配置）
+            remaining = _server_days_remaining(server, default_total_days, today)
+            if remaining is None:
+                self.logger.error(f"处理服务器 {ip} 时出错: 添加日期或生命周期格式错误")
                 continue
+            if remaining < 0:
+                self.logger.warning(f"服务器 {ip} 已过期")
+                continue
+
+            # 添加剩余天数信息
+            server['remaining_days'] = remaining
+            available.append(server)
 
         return available
     
-    def select_target_server(self, current_remaining_days: int) -> Optional[Dict]:
+    def select_target_server(self, current_remaining_days: int, current_ip: Optional[str] = None,
+                             nodes_data: Optional[Dict] = None) -> Optional[Dict]:
         """
         选择目标服务器
         
@@ -128,6 +298,8 @@ class Scanner:
         
         Args:
             current_remaining_days: 当前服务器剩余天数
+            current_ip: 当前服务器IP（可选）
+            nodes_data: 已加载的服务器列表（可选）
             
         Returns:
             选中的服务器信息，如果没有合适的返回None
@@ -135,7 +307,7 @@ class Scanner:
         threshold = self.config['lifecycle']['migrate_threshold_days']
         min_gain = self.config['lifecycle']['minimum_gain_days']
         
-        available = self.get_available_servers()
+        available = self.get_available_servers(current_ip=current_ip, nodes_data=nodes_data)
         
         if not available:
             self.logger.error("没有可用的服务器")
@@ -143,12 +315,12 @@ class Scanner:
         
         self.logger.info(f"找到 {len(available)} 个可用服务器")
         
-        # 优先级1: 剩余时间 > 5天
-        candidates_high = [s for s in available if s['remaining_days'] > threshold]
+        # 两个优先级都选剩余时间最长的服务器，而筛选条件都是“剩余时间大于某值”：
+        # 只要最长的那台满足条件，它就是该优先级的选择，一次遍历即可
+        target = max(available, key=lambda x: x['remaining_days'])
         
-        if candidates_high:
-            # 选择时间最长的
-            target = max(candidates_high, key=lambda x: x['remaining_days'])
+        # 优先级1: 剩余时间 > 5天
+        if target['remaining_days'] > threshold:
             self.logger.info(
                 f"选择高优先级服务器: {target['ip']} "
                 f"(剩余 {target['remaining_days']} 天)"
@@ -156,13 +328,7 @@ class Scanner:
             return target
         
         # 优先级2: 至少比当前多1天
-        candidates_low = [
-            s for s in available 
-            if s['remaining_days'] > (current_remaining_days + min_gain)
-        ]
-        
-        if candidates_low:
-            target = max(candidates_low, key=lambda x: x['remaining_days'])
+        if target['remaining_days'] > (current_remaining_days + min_gain):
             self.logger.info(
                 f"选择低优先级服务器: {target['ip']} "
                 f"(剩余 {target['remaining_days']} 天)"
@@ -176,14 +342,19 @@ class Scanner:
         )
         return None
 
-    def select_longest_remaining_server(self) -> Optional[Dict]:
+    def select_longest_remaining_server(self, current_ip: Optional[str] = None,
+                                        nodes_data: Optional[Dict] = None) -> Optional[Dict]:
         """
         选择剩余时间最长的服务器（用于强制迁移）
 
+        Args:
+            current_ip: 当前服务器IP（可选）
+            nodes_data: 已加载的服务器列表（可选）
+
         Returns:
             剩余时间最长的服务器信息，如果没有可用服务器返回None
         """
-        available = self.get_available_servers()
+        available = self.get_available_servers(current_ip=current_ip, nodes_data=nodes_data)
 
         if not available:
             self.logger.error("没有可用的服务器")
@@ -209,26 +380,19 @@ class Scanner:
             **kwargs: 其他要更新的字段
         """
         nodes_data = self.load_nodes()
-        servers = nodes_data.get('servers', [])
-        
-        updated = False
-        for server in servers:
-            if server.get('ip') == ip:
-                server['status'] = status
-                server['last_heartbeat'] = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-                
-                # 更新其他字段
-                for key, value in kwargs.items():
-                    server[key] = value
-                
-                updated = True
-                self.logger.info(f"服务器 {ip} 状态已更新为: {status}")
-                break
+        server = self.index_by_ip(nodes_data).get(ip)
         
-        if not updated:
+        if server is None:
             self.logger.warning(f"未找到服务器: {ip}")
             return
         
+        server['status'] = status
+        server['last_heartbeat'] = format_datetime()
+        
+        # 更新其他字段
+        server.update(kwargs)
+        self.logger.info(f"服务器 {ip} 状态已更新为: {status}")
+        
         self.save_nodes(nodes_data)
     
     def add_server(self, ip: str, status: str = "idle", notes: str = "", total_days: int = None) -> bool:
@@ -250,10 +414,9 @@ class Scanner:
         servers = nodes_data.get('servers', [])
 
         # 检查是否已存在
-        for server in servers:
-            if server.get('ip') == ip:
-                self.logger.warning(f"服务器已存在: {ip}")
-                return False
+        if any(server.get('ip') == ip for server in servers):
+            self.logger.warning(f"服务器已存在: {ip}")
+            return False
 
         # 系统自动记录当前时间
         added_date = format_date()
@@ -291,17 +454,12 @@ class Scanner:
             是否成功删除
         """
         nodes_data = self.load_nodes()
-        servers = nodes_data.get('servers', [])
 
         # 查找并删除服务器
-        initial_count = len(servers)
-        servers = [s for s in servers if s.get('ip') != ip]
-
-        if len(servers) == initial_count:
+        if not self.remove_server_inplace(ip, nodes_data):
             self.logger.warning(f"未找到服务器: {ip}")
             return False
 
-        nodes_data['servers'] = servers
         self.save_nodes(nodes_data)
         self.logger.info(f"✅ 已删除服务器: {ip}")
 
@@ -321,26 +479,27 @@ class Scanner:
             self.logger.info("服务器列表为空")
             return
 
-        self.logger.info("=" * 80)
-        self.logger.info(f"{'IP地址':<18} {'剩余天数':<12} {'状态':<12} {'备注':<30}")
-        self.logger.info("=" * 80)
+        # 整张表拼好后一次输出（逐行输出时每行都要经过日志框架的加锁和格式化）
+        separator = "=" * 80
+        lines = [separator, f"{'IP地址':<18} {'剩余天数':<12} {'状态':<12} {'备注':<30}", separator]
 
+        default_total_days = self.config['lifecycle']['total_days']
+        today = date.today().toordinal()
         for server in servers:
             if filter_status and server.get('status') != filter_status:
                 continue
 
-            try:
-                # 优先使用服务器自己的 total_days
-                total_days = server.get('total_days', self.config['lifecycle']['total_days'])
-                remaining = calculate_days_remaining(server['added_date'], total_days)
-            except:
+            # 优先使用服务器自己的 total_days
+            remaining = _server_days_remaining(server, default_total_days, today)
+            if remaining is None:
                 remaining = -999
 
-            self.logger.info(
+            lines.append(
                 f"{server.get('ip', 'N/A'):<18} "
                 f"{remaining:<12} "
                 f"{server.get('status', 'N/A'):<12} "
                 f"{server.get('notes', ''):<30}"
             )
 
-        self.logger.info("=" * 80)
+        lines.append(separator)
+        self.logger.info("\n" + "\n".join(lines))
@@ -4,80 +4,197 @@
 """
 
 import os
+import re
 import sys
+import json
+import shlex
+import shutil
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 import socket
+import ipaddress
+import threading
 import subprocess
+import http.client
+import urllib.request
 from datetime import datetime
-from typing import Dict, Any, Optional
-import colorlog
-from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时使用标准库 json
+    orjson = None
 
 
 class Logger:
     """日志管理器"""
     
     _instance = None
+    # 保护单例创建和 setup()，避免多线程同时初始化时重复挂载 handler
+    _lock = threading.RLock()
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(Logger, cls).__new__(cls)
-            cls._instance._initialized = False
+            with cls._lock:
+                if cls._instance is None:
+                    instance = super(Logger, cls).__new__(cls)
+                    instance.logger = None
+                    instance._listener = None
+                    instance._file_buffer = None
+                    instance._flush_stop = None
+                    atexit.register(instance.shutdown)
+                    cls._instance = instance
         return cls._instance
     
-    def __init__(self):
-        if self._initialized:
-            return
-        self._initialized = True
-        self.logger = None
-    
-    def setup(self, log_level: str = "INFO", log_file: Optional[str] = None):
-        """设置日志"""
-        # 创建logger
-        self.logger = logging.getLogger("HermitCrab")
-        self.logger.setLevel(getattr(logging, log_level))
-        
-        # 清除已有的handlers
-        self.logger.handlers.clear()
+    def setup(self, log_level: str = "INFO", log_file: Optional[str] = None, log_buffer: int = 8192):
+        """
+        设置日志
         
-        # 彩色控制台输出
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(getattr(logging, log_level))
-        
-        # 彩色格式
-        color_formatter = colorlog.ColoredFormatter(
-            '%(log_color)s[%(asctime)s] [%(levelname)s]%(reset)s %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S',
-            log_colors={
-                'DEBUG': 'cyan',
-                'INFO': 'green',
-                'WARNING': 'yellow',
-                'ERROR': 'red',
-                'CRITICAL': 'red,bg_white',
-            }
-        )
-        console_handler.setFormatter(color_formatter)
-        self.logger.addHandler(console_handler)
+        logger 上只挂 QueueHandler，格式化和控制台/文件写入由后台 QueueListener 线程完成，
+        调用方不会阻塞在磁盘 I/O 上
         
-        # 文件输出
-        if log_file:
-            os.makedirs(os.path.dirname(log_file), exist_ok=True)
-            file_handler = logging.FileHandler(log_file, encoding='utf-8')
-            file_handler.setLevel(getattr(logging, log_level))
-            file_formatter = logging.Formatter(
-                '[%(asctime)s] [%(levelname)s] %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-            )
-            file_handler.setFormatter(file_formatter)
-            self.logger.addHandler(file_handler)
+        Args:
+            log_level: 日志级别
+            log_file: 日志文件路径（可选）
+            log_buffer: 文件日志缓冲条数（每秒及 ERROR 以上立即写入），0 表示逐条写入
+        """
+        with self._lock:
+            # 重复设置时先停止旧的后台线程（会处理完队列中剩余的日志）
+            self.shutdown()
+            
+            # 日志级别只解析一次，logger 和各 handler 共用
+            level = getattr(logging, log_level)
+            
+            # 创建logger
+            self.logger = logging.getLogger("HermitCrab")
+            self.logger.setLevel(level)
+            
+            # 清除已有的handlers
+            self.logger.handlers.clear()
+            handlers = []
+            
+            # 彩色控制台输出
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(level)
+            
+            # 彩色格式（colorlog 按需导入；未安装时使用普通格式）
+            try:
+                import colorlog
+            except ImportError:
+                colorlog = None
+            
+            if colorlog is not None:
+                console_formatter = colorlog.ColoredFormatter(
+                    '%(log_color)s[%(asctime)s] [%(levelname)s]%(reset)s %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S',
+                    log_colors={
+                        'DEBUG': 'cyan',
+                        'INFO': 'green',
+                        'WARNING': 'yellow',
+                        'ERROR': 'red',
+                        'CRITICAL': 'red,bg_white',
+                    }
+                )
+            else:
+                console_formatter = logging.Formatter(
+                    '[%(asctime)s] [%(levelname)s] %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S'
+                )
+            console_handler.setFormatter(console_formatter)
+            handlers.append(console_handler)
+            
+            # 文件输出
+            if log_file:
+                os.makedirs(os.path.dirname(log_file), exist_ok=True)
+                file_handler = logging.FileHandler(log_file, encoding='utf-8')
+                file_handler.setLevel(level)
+                file_formatter = logging.Formatter(
+                    '[%(asctime)s] [%(levelname)s] %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S'
+                )
+                file_handler.setFormatter(file_formatter)
+            
+                if log_buffer > 0:
+                    # 攒批写入文件，减少 write 调用；ERROR 及以上立即写入，另有线程每秒刷新一次
+                    self._file_buffer = logging.handlers.MemoryHandler(
+                        capacity=log_buffer,
+                        flushLevel=logging.ERROR,
+                        target=file_handler,
+                        flushOnClose=True
+                    )
+                    self._file_buffer.setLevel(level)
+                    handlers.append(self._file_buffer)
+                    self._flush_stop = threading.Event()
+                    threading.Thread(
+                        target=self._flush_periodically,
+                        args=(self._file_buffer, self._flush_stop),
+                        name="log-flush",
+                        daemon=True
+                    ).start()
+                else:
+                    handlers.append(file_handler)
+            
+            log_queue = queue.SimpleQueue()
+            self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            self._listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            self._listener.start()
+    
+    @staticmethod
+    def _flush_periodically(buffer: logging.Handler, stop: threading.Event):
+        """每秒把缓冲的文件日志写入磁盘"""
+        while not stop.wait(1):
+            buffer.flush()
+    
+    def shutdown(self):
+        """停止后台日志线程（输出队列中剩余的日志并写入文件后返回）"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._file_buffer is not None:
+            self._flush_stop.set()
+            self._file_buffer.close()
+            self._file_buffer = None
     
     def get_logger(self):
         """获取logger实例"""
         if self.logger is None:
-            self.setup()
+            with self._lock:
+                if self.logger is None:
+                    self.setup()
         return self.logger
 
 
+# .env 文件的固定候选位置（优先级从高到低）：当前工作目录、脚本所在目录
+_ENV_CANDIDATES = (
+    ".env",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"),
+)
+
+
+def _find_env_file() -> Optional[str]:
+    """
+    查找 .env 文件
+    
+    Returns:
+        找到的 .env 文件路径，不存在返回None
+    """
+    for path in _ENV_CANDIDATES:
+        if os.path.isfile(path):
+            return path
+
+    # 如果设置了 HERMIT_INSTALL_PATH 环境变量，也尝试该路径
+    install_path = os.getenv("HERMIT_INSTALL_PATH")
+    if install_path:
+        path = os.path.join(install_path, ".env")
+        if os.path.isfile(path):
+            return path
+    return None
+
+
 def load_env(env_path: Optional[str] = None):
     """
     加载 .env 环境变量文件
@@ -85,151 +202,246 @@ def load_env(env_path: Optional[str] = None):
     Args:
         env_path: .env 文件路径，默认为项目根目录的 .env
     """
+    global _config_cache
+    
     if env_path is None:
-        # 尝试多个可能的位置（优先级从高到低）
-        possible_paths = [
-            ".env",  # 当前工作目录
-            os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"),  # 脚本所在目录
-        ]
-        # 如果设置了 HERMIT_INSTALL_PATH 环境变量，也尝试该路径
-        install_path = os.getenv("HERMIT_INSTALL_PATH")
-        if install_path:
-            possible_paths.append(os.path.join(install_path, ".env"))
-
-        for path in possible_paths:
-            if os.path.exists(path):
-                env_path = path
-                break
-    
-    if env_path and os.path.exists(env_path):
+        env_path = _find_env_file()
+    
+    if env_path and os.path.isfile(env_path):
+        from dotenv import load_dotenv
         load_dotenv(env_path)
+        # 显式加载后下次 get_config() 按新的环境变量重建
+        _config_cache = None
         return True
     return False
 
 
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    解析JSON
+
+    优先使用 orjson（可直接解析 bytes，无需先解码为字符串）
+
+    Args:
+        data: JSON 字符串或 UTF-8 字节串
+
+    Returns:
+        解析结果
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """
+    序列化为JSON（UTF-8 字节串，非 ASCII 字符原样保留）
+
+    优先使用 orjson
+
+    Args:
+        obj: 要序列化的对象
+        indent: 是否缩进2格（便于人工阅读）
+        sort_keys: 是否按键排序
+
+    Returns:
+        JSON 字节串
+    """
+    if orjson is not None:
+        option = 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+    return json.dumps(
+        obj, indent=2 if indent else None, sort_keys=sort_keys, ensure_ascii=False
+    ).encode('utf-8')
+
+
+# get_config 缓存：((.env路径, 修改时间), 配置字典)
+_config_cache = None
+
+
 def get_config() -> Dict[str, Any]:
     """
     从环境变量加载配置（替代 config.yaml）
     
+    .env 文件未变化时返回同一个配置字典；文件修改后重新加载
+    （重新加载时 .env 中的值覆盖进程中已有的同名环境变量）
+    
     Returns:
         配置字典
     """
-    # 确保加载.env文件
-    load_env()
+    global _config_cache
     
-    def get_env(key: str, default=None):
-        """辅助函数：获取环境变量"""
-        return os.getenv(key, default)
+    env_path = _find_env_file()
+    try:
+        mtime = os.stat(env_path).st_mtime_ns if env_path else None
+    except OSError:
+        mtime = None
+    cache_key = (env_path, mtime)
     
-    def get_env_bool(key: str, default=False) -> bool:
-        """辅助函数：获取布尔值环境变量"""
-        val = os.getenv(key, str(default)).lower()
-        return val in ('true', '1', 'yes', 'on')
+    if _config_cache is not None and _config_cache[0] == cache_key:
+        return _config_cache[1]
     
-    def get_env_int(key: str, default=0) -> int:
-        """辅助函数：获取整数环境变量"""
-        try:
-            return int(os.getenv(key, default))
-        except:
-            return default
+    # 确保加载.env文件（python-dotenv 只在确实存在 .env 时导入）
+    if env_path:
+        from dotenv import load_dotenv
+        load_dotenv(env_path, override=_config_cache is not None)
     
+    config = _build_config()
+    _config_cache = (cache_key, config)
+    return config
+
+
+# 收件人列表按逗号/空白切分
+_EMAIL_SPLIT = re.compile(r'[^,\s]+')
+
+# 布尔型环境变量视为真的取值
+_BOOL_TRUE = frozenset(('true', '1', 'yes', 'on'))
+
+
+def _env_bool(key: str, default=False) -> bool:
+    """获取布尔值环境变量"""
+    return os.getenv(key, str(default)).lower() in _BOOL_TRUE
+
+
+def _env_int(key: str, default=0) -> int:
+    """获取整数环境变量（无法解析时返回默认值）"""
+    try:
+        return int(os.getenv(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _build_config() -> Dict[str, Any]:
+    """
+    根据当前环境变量构建配置字典
+    
+    Returns:
+        配置字典
+    """
     # 构建配置字典
-    install_path = get_env('HERMIT_INSTALL_PATH', '/root/hermit_crab')
+    install_path = os.getenv('HERMIT_INSTALL_PATH', '/root/hermit_crab')
+    local_cache = os.path.join(install_path, 'data', 'nodes.json')
+    exclude_file = os.path.join(install_path, 'config', 'exclude_list.txt')
     
     return {
         'base': {
             'install_path': install_path,
-            'log_level': get_env('HERMIT_LOG_LEVEL', 'INFO'),
-            'current_domain': get_env('HERMIT_CURRENT_DOMAIN', ''),
+            'log_level': os.getenv('HERMIT_LOG_LEVEL', 'INFO'),
+            'log_buffer': _env_int('HERMIT_LOG_BUFFER', 8192),
+            'current_domain': os.getenv('HERMIT_CURRENT_DOMAIN', ''),
         },
         'lifecycle': {
-            'total_days': get_env_int('HERMIT_TOTAL_DAYS', 20),
-            'migrate_threshold_days': get_env_int('HERMIT_MIGRATE_THRESHOLD', 5),
-            'minimum_gain_days': get_env_int('HERMIT_MINIMUM_GAIN_DAYS', 1),
-            'check_interval': get_env_int('HERMIT_CHECK_INTERVAL', 3600),
+            'total_days': _env_int('HERMIT_TOTAL_DAYS', 20),
+            'migrate_threshold_days': _env_int('HERMIT_MIGRATE_THRESHOLD', 5),
+            'minimum_gain_days': _env_int('HERMIT_MINIMUM_GAIN_DAYS', 1),
+            'check_interval': _env_int('HERMIT_CHECK_INTERVAL', 3600),
         },
         'github': {
-            'enabled': get_env_bool('HERMIT_GITHUB_ENABLED', True),
-            'repo': get_env('HERMIT_GITHUB_REPO', ''),
+            'enabled': _env_bool('HERMIT_GITHUB_ENABLED', True),
+            'repo': os.getenv('HERMIT_GITHUB_REPO', ''),
             'token_env': 'HERMIT_GITHUB_TOKEN',
-            'nodes_file': get_env('HERMIT_GITHUB_NODES_FILE', 'nodes.json'),
-            'local_cache': f"{install_path}/data/nodes.json",
+            'nodes_file': os.getenv('HERMIT_GITHUB_NODES_FILE', 'nodes.json'),
+            'cache_ttl': _env_int('HERMIT_GITHUB_CACHE_TTL', 10),
+            'local_cache': local_cache,
         },
         'cloudflare': {
-            'enabled': get_env_bool('HERMIT_CF_ENABLED', True),
-            'zone_id': get_env('HERMIT_CF_ZONE_ID', ''),
+            'enabled': _env_bool('HERMIT_CF_ENABLED', True),
+            'zone_id': os.getenv('HERMIT_CF_ZONE_ID', ''),
             'api_token_env': 'HERMIT_CF_TOKEN',
-            'domain': get_env('HERMIT_CF_DOMAIN', ''),
-            'ttl': get_env_int('HERMIT_CF_TTL', 120),
+            'domain': os.getenv('HERMIT_CF_DOMAIN', ''),
+            'ttl': _env_int('HERMIT_CF_TTL', 120),
         },
         'security': {
-            'ssh_key_path': get_env('HERMIT_SSH_KEY_PATH', '/root/.ssh/hermit_crab_id_rsa'),
-            'ssh_user': get_env('HERMIT_SSH_USER', 'root'),
+            'ssh_key_path': os.getenv('HERMIT_SSH_KEY_PATH', '/root/.ssh/hermit_crab_id_rsa'),
+            'ssh_user': os.getenv('HERMIT_SSH_USER', 'root'),
             'use_password': True,
         },
         'migration': {
-            'ssh_timeout': get_env_int('HERMIT_SSH_TIMEOUT', 30),
-            'max_retries': get_env_int('HERMIT_MAX_RETRIES', 3),
-            'retry_interval': get_env_int('HERMIT_RETRY_INTERVAL', 300),
+            'ssh_timeout': _env_int('HERMIT_SSH_TIMEOUT', 30),
+            'max_retries': _env_int('HERMIT_MAX_RETRIES', 3),
+            'retry_interval': _env_int('HERMIT_RETRY_INTERVAL', 300),
+            'tar_concurrency': _env_int('HERMIT_TAR_CONCURRENCY', 4),
+            'tar_compressor': os.getenv('HERMIT_TAR_COMPRESSOR', 'gzip'),
+            'ssh_cipher': os.getenv('HERMIT_SSH_CIPHER', ''),
+            'resume_window': _env_int('HERMIT_MIGRATION_RESUME_WINDOW', 3600),
         },
         'rsync': {
-            'bandwidth_limit': get_env_int('HERMIT_RSYNC_BANDWIDTH_LIMIT', 0),
-            'timeout': get_env_int('HERMIT_RSYNC_TIMEOUT', 7200),
-            'exclude_file': f"{install_path}/config/exclude_list.txt",
-            'extra_args': get_env('HERMIT_RSYNC_EXTRA_ARGS', '-aAXvzP --delete --numeric-ids'),
+            'bandwidth_limit': _env_int('HERMIT_RSYNC_BANDWIDTH_LIMIT', 0),
+            'timeout': _env_int('HERMIT_RSYNC_TIMEOUT', 7200),
+            'exclude_file': exclude_file,
+            'extra_args': os.getenv('HERMIT_RSYNC_EXTRA_ARGS', '-aAXvzP --delete --numeric-ids'),
+            'compressor': os.getenv('HERMIT_RSYNC_COMPRESSOR', ''),
+            'compress_level': _env_int('HERMIT_RSYNC_COMPRESS_LEVEL', 0),
         },
         'feedback': {
-            'startup_wait': get_env_int('HERMIT_STARTUP_WAIT', 120),
+            'startup_wait': _env_int('HERMIT_STARTUP_WAIT', 120),
             'max_retry': 10,
             'retry_interval': 300,
         },
         'notification': {
-            'enabled': get_env_bool('HERMIT_NOTIFICATION_ENABLED', False),
-            'resend_api_key': get_env('HERMIT_RESEND_API_KEY', ''),
-            'from_email': get_env('HERMIT_NOTIFICATION_FROM', ''),
-            'to_emails': [
-                email.strip()
-                for email in get_env('HERMIT_NOTIFICATION_TO', '').split(',')
-                if email.strip()
-            ],
+            'enabled': _env_bool('HERMIT_NOTIFICATION_ENABLED', False),
+            'resend_api_key': os.getenv('HERMIT_RESEND_API_KEY', ''),
+            'from_email': os.getenv('HERMIT_NOTIFICATION_FROM', ''),
+            'to_emails': _EMAIL_SPLIT.findall(os.getenv('HERMIT_NOTIFICATION_TO', '')),
         },
         'debug': {
-            'enabled': get_env_bool('HERMIT_DEBUG', False),
-            'dry_run': get_env_bool('HERMIT_DRY_RUN', False),
-            'skip_reboot': get_env_bool('HERMIT_SKIP_REBOOT', False),
+            'enabled': _env_bool('HERMIT_DEBUG', False),
+            'dry_run': _env_bool('HERMIT_DRY_RUN', False),
+            'skip_reboot': _env_bool('HERMIT_SKIP_REBOOT', False),
         },
     }
 
 
-def get_current_ip() -> str:
+# get_current_ip 缓存：(IP, 获取时间)
+_ip_cache = None
+
+
+def get_current_ip(force: bool = False) -> str:
     """
     获取当前服务器的公网IP
     
+    结果缓存 HERMIT_IP_CACHE_TTL 秒（默认300），期间重复调用不再访问外部服务
+    
+    Args:
+        force: 是否忽略缓存重新探测（如迁移后IP可能已变化）
+    
     Returns:
         IP地址字符串
     """
+    global _ip_cache
+    
     try:
-        # 尝试通过外部服务获取公网IP
-        result = subprocess.run(
-            ['curl', '-s', 'ifconfig.me'],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip()
-    except:
-        pass
+        ttl = int(get_env_variable('HERMIT_IP_CACHE_TTL', '300'))
+    except ValueError:
+        ttl = 300
+    now = time.monotonic()
+    if not force and _ip_cache is not None and now - _ip_cache[1] < ttl:
+        return _ip_cache[0]
     
+    ip = None
     try:
-        # 备用方法：获取本地IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except:
-        return "127.0.0.1"
+        # 尝试通过外部服务获取公网IP（进程内请求，无需启动 curl）
+        with urllib.request.urlopen('https://ifconfig.me/ip', timeout=5) as response:
+            ip = str(ipaddress.ip_address(response.read().decode().strip()))
+    except (OSError, ValueError, http.client.HTTPException):
+        pass
+    
+    if ip is None:
+        try:
+            # 备用方法：获取本地IP（UDP connect 只查路由表，不发送数据）
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(("8.8.8.8", 80))
+                ip = s.getsockname()[0]
+        except OSError:
+            # 探测失败的结果不缓存
+            return "127.0.0.1"
+    
+    _ip_cache = (ip, now)
+    return ip
 
 
 def get_hostname() -> str:
@@ -237,25 +449,60 @@ def get_hostname() -> str:
     return socket.gethostname()
 
 
-def run_command(cmd: str, timeout: int = 300, shell: bool = True) -> tuple:
+# 出现这些字符说明命令依赖 shell 语法（管道、重定向、变量、通配符、多条命令等）
+_SHELL_META = frozenset(';&|<>$`*?[]~(){}#!\n\\')
+
+
+def _split_simple_command(cmd: str) -> Optional[list]:
+    """
+    把不依赖 shell 语法的简单命令拆分为参数列表
+
+    Args:
+        cmd: 命令字符串
+
+    Returns:
+        参数列表；命令需要 shell 解释时返回None
+    """
+    if not _SHELL_META.isdisjoint(cmd):
+        return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return None
+    # 行首的 VAR=value 赋值和 shell 内建命令（cd、export 等）只能交给 shell
+    if not argv or '=' in argv[0] or not check_command_exists(argv[0]):
+        return None
+    return argv
+
+
+def run_command(cmd: str, timeout: int = 300, shell: bool = True,
+                env: Optional[Dict[str, str]] = None) -> tuple:
     """
     执行shell命令
     
     Args:
         cmd: 命令字符串
         timeout: 超时时间（秒）
-        shell: 是否使用shell执行
+        shell: 是否使用shell执行（不含 shell 语法的简单命令会自动直接执行）
+        env: 额外的环境变量（合并到当前环境）
         
     Returns:
         (returncode, stdout, stderr)
     """
+    # 简单命令直接执行，省去启动 /bin/sh 的一次进程创建
+    if shell and isinstance(cmd, str):
+        argv = _split_simple_command(cmd)
+        if argv is not None:
+            cmd, shell = argv, False
+    
     try:
         result = subprocess.run(
             cmd,
             shell=shell,
             capture_output=True,
             text=True,
-            timeout=timeout
+            timeout=timeout,
+            env={**os.environ, **env} if env else None
         )
         return result.returncode, result.stdout, result.stderr
     except subprocess.TimeoutExpired:
@@ -296,7 +543,12 @@ def calculate_days_remaining(added_date: str, total_days: int) -> int:
     """
     try:
         from datetime import timedelta
-        added = datetime.strptime(added_date, "%Y-%m-%d")
+        try:
+            # 标准格式走 C 实现的快速路径
+            added = datetime.fromisoformat(added_date)
+        except ValueError:
+            # 兼容未补零等非标准写法（如 2024-1-5）
+            added = datetime.strptime(added_date, "%Y-%m-%d")
         expire = added + timedelta(days=total_days)
         now = datetime.now()
         delta = expire - now
@@ -331,13 +583,15 @@ def format_datetime(date_obj: datetime = None) -> str:
         格式化的日期时间字符串
     """
     if date_obj is None:
-        date_obj = datetime.now()
+        # 当前时间直接用 time.strftime 格式化，无需创建 datetime 对象
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ")
     return date_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
+@lru_cache(maxsize=128)
 def check_command_exists(command: str) -> bool:
     """
-    检查命令是否存在
+    检查命令是否存在（在进程内查找 PATH，结果缓存；安装软件包后清空缓存）
     
     Args:
         command: 命令名称
@@ -345,41 +599,52 @@ def check_command_exists(command: str) -> bool:
     Returns:
         是否存在
     """
-    result = subprocess.run(
-        f"which {command}",
-        shell=True,
-        capture_output=True
-    )
-    return result.returncode == 0
+    return shutil.which(command) is not None
 
 
-def install_package(package: str) -> bool:
+def install_packages(packages: List[str]) -> bool:
     """
-    安装系统包
+    安装系统包（多个包合并为一次 apt-get 调用，只解析一次软件包索引和依赖）
     
     Args:
-        package: 包名
+        packages: 包名列表
         
     Returns:
         是否成功
     """
     logger = Logger().get_logger()
-    logger.info(f"正在安装 {package}...")
+    names = ' '.join(packages)
+    logger.info(f"正在安装 {names}...")
     
     result = subprocess.run(
-        f"apt-get install -y {package}",
-        shell=True,
-        capture_output=True
+        ['apt-get', 'install', '-y', *packages],
+        capture_output=True,
+        text=True,
+        env={**os.environ, 'DEBIAN_FRONTEND': 'noninteractive'}
     )
     
     if result.returncode == 0:
-        logger.info(f"{package} 安装成功")
+        logger.info(f"{names} 安装成功")
+        check_command_exists.cache_clear()
         return True
     else:
-        logger.error(f"{package} 安装失败: {result.stderr.decode()}")
+        logger.error(f"{names} 安装失败: {result.stderr}")
         return False
 
 
+def install_package(package: str) -> bool:
+    """
+    安装系统包
+    
+    Args:
+        package: 包名（多个包用空格分隔）
+        
+    Returns:
+        是否成功
+    """
+    return install_packages(package.split())
+
+
 def get_ssh_password(target: str = None) -> Optional[str]:
     """
     获取SSH密码
@@ -398,25 +663,17 @@ def get_ssh_password(target: str = None) -> Optional[str]:
     # 方式1: 先尝试从 HERMIT_SSH_PASSWORD_MAP 获取特定服务器密码
     password_map = get_env_variable('HERMIT_SSH_PASSWORD_MAP')
     if password_map and target:
-        for mapping in password_map.split('|'):
-            if ':' in mapping:
-                host, password = mapping.split(':', 1)
-                if host.strip() == target.strip():
-                    return password
+        password = _cached_password_map(password_map).get(target.strip())
+        if password is not None:
+            return password
     
     # 方式2: 从 HERMIT_SSH_PASSWORD 获取
     password_env = get_env_variable('HERMIT_SSH_PASSWORD')
     if password_env:
         # 检查是否为映射格式（包含 | 或 :）
         if '|' in password_env and target:
-            # 映射格式：ip1:pass1|ip2:pass2
-            for mapping in password_env.split('|'):
-                if ':' in mapping:
-                    host, password = mapping.split(':', 1)
-                    if host.strip() == target.strip():
-                        return password
-            # 未找到匹配，返回None（不使用默认密码）
-            return None
+            # 映射格式：ip1:pass1|ip2:pass2（未找到匹配返回None，不使用默认密码）
+            return _cached_password_map(password_env).get(target.strip())
         else:
             # 通用密码格式
             return password_env
@@ -424,9 +681,12 @@ def get_ssh_password(target: str = None) -> Optional[str]:
     return None
 
 
-def parse_password_map(password_str: str) -> Dict[str, str]:
+@lru_cache(maxsize=8)
+def _cached_password_map(password_str: str) -> Dict[str, str]:
     """
-    解析密码映射字符串
+    按原始字符串缓存解析结果，环境变量不变时不再重复切分（返回值只读）
+    
+    同一主机出现多次时以第一次为准，与逐项匹配的行为一致
     
     Args:
         password_str: 密码映射字符串，格式：ip1:pass1|ip2:pass2
@@ -435,10 +695,25 @@ def parse_password_map(password_str: str) -> Dict[str, str]:
         密码字典
     """
     password_map = {}
-    if password_str:
-        for mapping in password_str.split('|'):
-            if ':' in mapping:
-                host, password = mapping.split(':', 1)
-                password_map[host.strip()] = password
+    for mapping in password_str.split('|'):
+        if ':' in mapping:
+            host, password = mapping.split(':', 1)
+            password_map.setdefault(host.strip(), password)
     return password_map
 
+
+def parse_password_map(password_str: str) -> Dict[str, str]:
+    """
+    解析密码映射字符串
+    
+    Args:
+        password_str: 密码映射字符串，格式：ip1:pass1|ip2:pass2
+        
+    Returns:
+        密码字典
+    """
+    if not password_str:
+        return {}
+    # 与 get_ssh_password 共用同一解析实现（返回副本，调用方可修改）
+    return dict(_cached_password_map(password_str))
+